@@ -27,7 +27,19 @@ import pandas as pd
 from matplotlib import pyplot as plt 
 import numpy as np
 import datetime as datetime
+import hashlib
 import matplotlib.backends.backend_pdf
+from scipy import special, stats
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from pypdf import PdfWriter                               #only needed to assemble pages rendered in parallel
+except ImportError:
+    PdfWriter = None
 
 
 # In[2]:
@@ -35,58 +47,41 @@ import matplotlib.backends.backend_pdf
 
 '''define functions'''
 
-'''define function to make days column in df'''
+'''define functions to reduce duplicate results and make days column in df'''
 
-def column_days(df):
-    
-    #Make a list of the dates 
-    df = df.sort_values(['Date'], ascending = True)
-    dates = []
-    for date in df['Date']:
-        dates.append(date)
-    
-    
-    #make the timedelta list for difference between dates
-    subtract = df['Date'].min()
-    days = []
-    index_tracker = 0
-    for date in dates:
-        diff = (date - subtract)
-        days.append(diff)
-        subtract = dates[index_tracker]
-        index_tracker = index_tracker + 1
-    
-    
-    #create the dates dataframe
-    data = {"Date": dates, "Days": days}
-    dates_df = pd.DataFrame(data)
+WELL_KEYS = ['LOC_NAME']
+
+DUPLICATE_RULES = ['mean', 'max', 'all']
+
+def reduce_duplicates(df, rule='all', keys=WELL_KEYS):
     
     
-    #transform the days column from timedelta to number of days
-    dates_df['Days'] = dates_df['Days'].dt.days
+    #keep all results, including field duplicates and splits
+    if rule == 'all':
+        return df
+    if rule not in DUPLICATE_RULES:
+        raise ValueError("duplicate rule must be one of {}, not {!r}".format(DUPLICATE_RULES, rule))
     
     
-    #make the days_total list from dates_df
-    days_min = dates_df['Days'].min()
-    days_total =[]
-    for days in dates_df['Days']:
-        total = days + days_min
-        days_total.append(total)
-        days_min = total
+    #reduce the results of each well and date to one row, the first row keeps its place
+    date_keys = [df[key] for key in keys + ['Date']]
+    values = df['REPORT_RESULT_VALUE'].groupby(date_keys).transform(rule)
+    first = ~df.duplicated(keys + ['Date'])
     
-    #drop the Days column
-    dates_df = dates_df.drop(columns='Days')
-        
+    return df.assign(REPORT_RESULT_VALUE = values)[first]
+
+
+def column_days(df, keys=WELL_KEYS):
     
-    #add the days_total list to the dates_df 
-    dates_df['days'] = days_total
+    #find the first sample date of each well
+    first_date = df.groupby(keys)['Date'].transform('min')
     
     
-    #merge the days_total to the df. 
-    df_1 = pd.merge(df, dates_df, on='Date')
+    #days since the first sample, row count and order are kept
+    df = df.assign(days = (df['Date'] - first_date).dt.days)
     
     
-    return df_1
+    return df
 
 
 # In[3]:
@@ -94,15 +89,16 @@ def column_days(df):
 
 '''define function to get C0 and add calculated Ln(C/C0) column '''
 
-def get_C0_column(df):
+def get_C0_column(df, keys=WELL_KEYS):
     
     
-    #find the CB concentration associated with day 0
-    C0 = df.loc[df['days'] == 0]['REPORT_RESULT_VALUE'].values[0]
+    #find the CB concentration associated with day 0 of each well
+    day0 = df['REPORT_RESULT_VALUE'].where(df['days'] == 0)
+    df = df.assign(C0 = day0.groupby([df[key] for key in keys]).transform('first'))
     
     
-    #Calculate the Ln(C/C0) column in df_1
-    df['Ln_conc_c0'] = np.log((df['REPORT_RESULT_VALUE']/C0))
+    #Calculate the Ln(C/C0) column in df
+    df['Ln_conc_c0'] = np.log((df['REPORT_RESULT_VALUE']/df['C0']))
     
     return df
 
@@ -125,25 +121,262 @@ def consolidate(df):
 # In[5]:
 
 
-''' define r-squared function, r_sqd()'''
+'''define slope, intercept and r-squared function, solve()'''
 
-def r_sqd(df):
-    corr_matrix = np.corrcoef(df['days'], df['Ln_conc_c0'])
-    corr_xy = corr_matrix[0,1]
-    rsqd = corr_xy**2
-    return rsqd
+def solve(df, keys=WELL_KEYS):
+    
+    #least-squares sums of Ln(C/C0) vs. days for every well in one pass
+    x_days = df['days'].astype(float)
+    y_conc = df['Ln_conc_c0']
+    terms = pd.DataFrame({'n': 1.0, 'x': x_days, 'y': y_conc, 'xx': x_days*x_days,
+                          'xy': x_days*y_conc, 'yy': y_conc*y_conc})
+    sums = terms.groupby([df[key] for key in keys]).sum()
+    
+    
+    #centered sums of squares
+    sxx = sums['xx'] - sums['x']**2/sums['n']
+    sxy = sums['xy'] - sums['x']*sums['y']/sums['n']
+    syy = sums['yy'] - sums['y']**2/sums['n']
+    
+    
+    #closed-form slope, y-intercept and r-squared
+    m = sxy/sxx
+    b = (sums['y'] - m*sums['x'])/sums['n']
+    rsqd = np.clip(sxy**2/(sxx*syy), 0, 1)      #rounding can push a two-point fit just past 1
+    
+    #keep the sums the forecast needs for its confidence limits
+    fits = pd.DataFrame({'N_Samples': sums['n'].astype(int), 'Slope': m,
+                         'Intercept': b, 'R-Squared': rsqd, 'Mean_Days': sums['x']/sums['n'],
+                         'Sxx': sxx, 'SSE': syy - m*sxy})
+    return fits
+
+
+FIT_COLUMNS = ['N_Samples', 'Slope', 'Intercept', 'R-Squared']
+
+
+'''define censored regression function for non-detects, solve_censored()'''
+
+def solve_censored(df, keys=WELL_KEYS, weights=None, max_iter=500, tol=1e-10):
+    
+    
+    #Ln(C/C0) of non-detects is an upper limit at the reporting limit
+    groups = df.groupby(keys).ngroup().to_numpy()
+    index = df.groupby(keys).size().index
+    x_days = df['days'].to_numpy(dtype=float)
+    y_conc = df['Ln_conc_c0'].to_numpy(dtype=float)
+    censored = (df['INTERPRETED_QUALIFIERS'] == 'ND').to_numpy()
+    w = np.ones(len(df)) if weights is None else np.asarray(weights, dtype=float)
+    
+    
+    #weighted least-squares sums of every well
+    n_wells = len(index)
+    def wsum(values):
+        return np.bincount(groups, w*values, n_wells)
+    
+    sw, swx, swxx = wsum(1.0), wsum(x_days), wsum(x_days*x_days)
+    n = np.bincount(groups, minlength=n_wells).astype(float)
+    det = sw*swxx - swx**2
+    def fit(y):
+        swy, swxy = wsum(y), wsum(x_days*y)
+        m = (sw*swxy - swx*swy)/det
+        return m, (swy - m*swx)/sw
+    
+    
+    #start from the weighted fit with non-detects at the reporting limit
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m, b = fit(y_conc)
+        sigma = np.sqrt(wsum((y_conc - b[groups] - m[groups]*x_days)**2)/n)
+        sigma = np.maximum(sigma, 1e-6)
+        
+        
+        #EM iterations for all wells at once
+        for iteration in range(max_iter):
+            
+            #E-step - expected value and variance of each non-detect below its limit
+            mu = b[groups] + m[groups]*x_days
+            sigma_i = sigma[groups]/np.sqrt(w)
+            z = (y_conc - mu)/sigma_i
+            ratio = np.exp(stats.norm.logpdf(z) - special.log_ndtr(z))
+            y_exp = np.where(censored, mu - sigma_i*ratio, y_conc)
+            y_var = np.where(censored, sigma_i**2*(1 - z*ratio - ratio**2), 0.0)
+            
+            #M-step - weighted least squares on the expected values
+            m_new, b_new = fit(y_exp)
+            mu = b_new[groups] + m_new[groups]*x_days
+            sigma_new = np.sqrt(wsum((y_exp - mu)**2 + y_var)/n)
+            sigma_new = np.maximum(sigma_new, 1e-6)
+            
+            change = np.nanmax(np.abs(np.concatenate([m_new - m, b_new - b, sigma_new - sigma])), initial=0)
+            m, b, sigma = m_new, b_new, sigma_new
+            if change < tol:
+                break
+    
+    
+    #wells need three results to estimate the slope and the scatter
+    fitted = (n >= 3) & (det > 0)
+    censored_fits = pd.DataFrame({'Censored_Slope': np.where(fitted, m, np.nan),
+                                  'Censored_Intercept': np.where(fitted, b, np.nan),
+                                  'Censored_Sigma': np.where(fitted, sigma, np.nan),
+                                  'N_Non_Detects': np.bincount(groups, censored, n_wells).astype(int)},
+                                 index=index)
+    return censored_fits
+
+
+'''define inverse-variance weights from a result uncertainty column'''
+
+def inverse_variance_weights(df, column):
+    
+    #the variance of Ln(C) is about (uncertainty/C)^2
+    return (df['REPORT_RESULT_VALUE']/df[column])**2
 
 
 # In[6]:
 
 
-'''define slope and intercept function, solve()'''
+'''define the rate constant engine for all wells, rate_constants()'''
+
+def rate_constants(df, keys=WELL_KEYS, duplicates='all'):
+    
+    df = reduce_duplicates(df, duplicates, keys)              #apply the rule for results on one date
+    df = column_days(df, keys)                                #make the days column
+    df = get_C0_column(df, keys)                              #make the Ln(C/C0) column
+    fits = solve(df, keys)                                    #solve for slope, y-intercept and R-squared
+    df = df.sort_values(keys + ['Date'], kind='mergesort')    #order each well by sample date
+    
+    return df, fits
+
+
+'''define time-to-clean up forecast function, forecast()'''
+
+def forecast(df, fits, target, confidence=0.95, keys=WELL_KEYS):
+    
+    
+    #first sample date and C0 of each well
+    start = df.groupby(keys).agg(Start_Date = ('Date', 'min'), C0 = ('C0', 'first')).reindex(fits.index)
+    
+    
+    #days from the first sample until the trendline reaches Ln(target/C0)
+    n, m, b = fits['N_Samples'], fits['Slope'], fits['Intercept']
+    y_target = np.log(target/start['C0'])
+    days = ((y_target - b)/m).where(m < 0)
+    
+    
+    #Fieller limits - days where the confidence band of the trendline reaches the target
+    s_sqd = fits['SSE']/(n - 2)
+    t_crit = pd.Series(stats.t.ppf((1 + confidence)/2, n - 2), index=fits.index)
+    a = m**2 - t_crit**2*s_sqd/fits['Sxx']
+    d = y_target - (b + m*fits['Mean_Days'])
+    bounded = (m < 0) & (a > 0)
+    half_width = np.sqrt((t_crit**2*s_sqd*(d**2/fits['Sxx'] + a/n)).where(bounded))
+    days_lower = fits['Mean_Days'] + (m*d - half_width)/a
+    days_upper = fits['Mean_Days'] + (m*d + half_width)/a
+    
+    
+    #no cleanup date when the trendline is below the target at the first sample, a band below it starts there
+    below = days < 0
+    days, days_lower, days_upper = [current.where(~below) for current in (days, days_lower.clip(lower=0), days_upper)]
+    max_days = (pd.Timestamp.max - start['Start_Date']).dt.days
+    status = np.select([m.isna() | (m >= 0), below, days >= max_days],
+                       ['No decreasing trend', 'Below target at first sample', 'Past 2262'], 'Projected')
+    
+    
+    #convert days to dates, leaving dates past the pandas calendar blank
+    def to_date(days):
+        days = days[days < max_days]
+        return (start['Start_Date'] + pd.to_timedelta(days, unit='D').reindex(start.index)).dt.normalize()
+    
+    cleanup = pd.DataFrame({'Target_Concentration': target,
+                            'Projected_Cleanup_Date': to_date(days),
+                            'Cleanup_Date_Lower_Bound': to_date(days_lower),
+                            'Cleanup_Date_Upper_Bound': to_date(days_upper),
+                            'Forecast_Status': status,
+                            'Confidence_Level': confidence}, index=fits.index)
+    return cleanup
+
 
-def solve(df):
-    x_days = df['days'].array
-    y_conc = df['Ln_conc_c0'].array
-    m, b = np.polyfit(x_days, y_conc, 1)
-    return m, b
+'''define spatial attenuation function for each sampling event, spatial_attenuation()'''
+
+def spatial_attenuation(df, distances, freq='Q'):
+    
+    
+    #use numeric distances only, upgradient and in-system wells have none
+    distances = pd.to_numeric(distances, errors='coerce').dropna()
+    distances = distances[~distances.index.duplicated()]
+    df = df[df['LOC_NAME'].isin(distances.index) & (df['REPORT_RESULT_VALUE'] > 0)]
+    
+    
+    #average Ln(C) of each well in each sampling event
+    events = df['Date'].dt.to_period(freq).rename('Event')
+    ln_conc = np.log(df['REPORT_RESULT_VALUE']).groupby([events, df['LOC_NAME']]).mean()
+    codes, event_index = pd.factorize(ln_conc.index.get_level_values('Event'), sort=True)
+    x_dist = ln_conc.index.get_level_values('LOC_NAME').map(distances).to_numpy(dtype=float)
+    y_conc = ln_conc.to_numpy()
+    
+    
+    #least-squares sums of Ln(C) vs. distance for every event
+    n_events = len(event_index)
+    n = np.bincount(codes, minlength=n_events).astype(float)
+    sx, sy = np.bincount(codes, x_dist, n_events), np.bincount(codes, y_conc, n_events)
+    sxx, sxy = np.bincount(codes, x_dist*x_dist, n_events), np.bincount(codes, x_dist*y_conc, n_events)
+    syy = np.bincount(codes, y_conc*y_conc, n_events)
+    
+    
+    #stack the normal equations and solve every event at once
+    ata = np.stack([np.stack([n, sx], axis=-1), np.stack([sx, sxx], axis=-1)], axis=-2)
+    aty = np.stack([sy, sxy], axis=-1)[..., None]
+    solvable = (n >= 2) & (n*sxx - sx**2 > 0)
+    coef = np.full((n_events, 2), np.nan)
+    coef[solvable] = np.linalg.solve(ata[solvable], aty[solvable])[..., 0]
+    b, m = coef[:, 0], coef[:, 1]
+    
+    
+    #r-squared of each event
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsqd = (n*sxy - sx*sy)**2/((n*sxx - sx**2)*(n*syy - sy**2))
+    
+    attenuation = pd.DataFrame({'Event': event_index.astype(str), 'Event_Start': event_index.start_time,
+                                'N_Wells': n.astype(int), 'Attenuation_Rate': -m,
+                                'Intercept': b, 'R-Squared': np.where(solvable, rsqd, np.nan)})
+    return attenuation
+
+
+'''define spatial attenuation graphics function'''
+
+def graph_attenuation(df):
+    
+    
+    #Create figure and axes objects
+    fig = plt.figure(figsize=(8,6))
+    ax1 = plt.subplot(1,1,1)
+    
+    
+    #Plot the attenuation rate of each sampling event
+    ax1.plot(df['Event_Start'], df['Attenuation_Rate'], marker='D', color='blue')
+    ax1.axhline(0, color='black', linewidth=0.8)
+    
+    
+    #Label axes and title
+    ax1.set_xlabel('Sampling Event', fontsize=15)
+    ax1.set_ylabel('Attenuation Rate (1/ft)', fontsize =14)
+    plt.title('Bulk Attenuation with Distance from the Airsparge Line', fontsize =16)
+    
+    
+    #Set Font size for the ticks
+    for tick in ax1.get_xticklabels() + ax1.get_yticklabels():
+        tick.set_fontsize(12)
+    
+    return fig
+
+
+'''define function to rank values by their position in a list, rank_by()'''
+
+def rank_by(values, order):
+    
+    #position of each value in order, first occurrence wins
+    positions = pd.Series(range(len(order)), index=order)
+    positions = positions[~positions.index.duplicated()]
+    
+    return values.map(positions)
 
 
 # In[7]:
@@ -151,7 +384,7 @@ def solve(df):
 
 '''define graphics function'''
 
-def graph(df, well_id, airsparge_dist, m, b, r_sqd):
+def graph(df, well_id, airsparge_dist, m, b, r_squared):
     
     
     #Create figure and axes objects
@@ -206,6 +439,284 @@ def graph(df, well_id, airsparge_dist, m, b, r_sqd):
     return fig
 
 
+# In[ ]:
+
+
+'''define the reusable figure template - styled once, then updated for each well'''
+
+def graph_template():
+    
+    
+    #Create figure and axes objects
+    fig = plt.figure(figsize=(8,6))
+    ax1 = plt.subplot(1,1,1)
+    
+    
+    #Make a scatter and trendline without data
+    points = ax1.scatter([], [], marker='D', color='blue')
+    trendline, = ax1.plot([], [], color = 'black')
+    
+    
+    #Label axes
+    ax1.set_xlabel('Time (days)', fontsize=15)
+    ax1.set_ylabel('$\mathrm{Ln(C/C_0)}$', fontsize =14)
+    
+    
+    #Annotate the figure, the text is set for each well
+    equation = ax1.annotate("", xy=(0.4, 0.75), xycoords='figure fraction',
+                            xytext=(0.135,0.85), textcoords='offset points',fontsize =14,
+                            color='black')
+    
+    
+    #Set font size for the ticks, new ticks copy the first tick's style
+    for tick in ax1.get_xticklabels() + ax1.get_yticklabels():
+        tick.set_fontsize(14)
+    
+    template = {'fig': fig, 'points': points, 'trendline': trendline, 'equation': equation}
+    return template
+
+
+def update_graph(template, df, well_id, airsparge_dist, m, b, r_squared):
+    
+    fig = template['fig']
+    ax1 = fig.axes[0]
+    
+    
+    #Update the scatter and trendline with the data of this well
+    points = np.column_stack([df['days'], df['Ln_conc_c0']])
+    template['points'].set_offsets(points)
+    template['trendline'].set_data(df['days'], df['days']*m + b)
+    
+    
+    #Update the annotation
+    sign = '-' if b < 0 else '+'
+    template['equation'].set_text("y = {0:.4f}x {4} {1:.4f}\n$R^{2}$ = {3:.4f}".format(m, np.absolute(b), 2, r_squared, sign))
+    
+    
+    #Update the title
+    if airsparge_dist == 'Upgradient ':
+        ax1.set_title(well_id+' -- ' + 'Upgradient from the Airsparge Line', fontsize =18)
+    elif airsparge_dist == 'Within System Area':
+        ax1.set_title(well_id+' -- ' + 'Within Airsparge System Area', fontsize =18)
+    else:
+        ax1.set_title(well_id+' -- '+ str(airsparge_dist) + " ft downgradient from the Airsparge Line", fontsize =18)
+    
+    
+    #Rescale the axes to the data, relim() does not include the scatter
+    ax1.relim()
+    ax1.update_datalim(points[np.isfinite(points).all(axis=1)])
+    ax1.autoscale_view()
+    
+    return fig
+
+
+recycled = {}
+
+def recycled_template():
+    
+    #one template per process, so peak memory stays at one figure
+    if 'template' not in recycled:
+        recycled['template'] = graph_template()
+    
+    return recycled['template']
+
+
+# In[ ]:
+
+
+'''define functions to render the graphics into a pdf'''
+
+CAN_FORK = 'fork' in multiprocessing.get_all_start_methods()
+
+#compact pdfs only pay off for dense series - a marker image costs more than a few vector markers
+COMPACT_RC = {'pdf.compression': 9}     #maximum stream compression, the default Type 3 fonts are already subset
+
+def rasterize_markers(fig, rasterized=True):
+    
+    #draw the scatter as an image, the text, axes and trendline stay vectors
+    for ax in fig.axes:
+        for collection in ax.collections:
+            collection.set_rasterized(rasterized)
+
+
+def write_pages(jobs, path):
+    
+    #compact pages draw the markers as images at RASTER_DPI
+    options = {'dpi': RASTER_DPI} if COMPACT_PDF else {}
+    
+    #render one page per (df, well_id, airsparge_dist, m, b, r_squared) job
+    with plt.rc_context(COMPACT_RC if COMPACT_PDF else {}):
+        pdf = matplotlib.backends.backend_pdf.PdfPages(path + '.tmp')
+        for job in jobs:
+            if RECYCLE_FIGURES:
+                graphic = update_graph(recycled_template(), *job)
+            else:
+                graphic = graph(*job)
+            rasterize_markers(graphic, COMPACT_PDF)
+            pdf.savefig(graphic, **options)
+            if not RECYCLE_FIGURES:
+                plt.close(graphic)
+        pdf.close()
+    
+    #only complete pdfs take the final name
+    os.replace(path + '.tmp', path)
+    
+    return path
+
+
+def merge_pdfs(part_paths, path):
+    
+    #stitch the part pdfs together in the order given
+    writer = PdfWriter()
+    for part_path in part_paths:
+        writer.append(part_path)
+    
+    #drop the font copies embedded by each part (pypdf 4.3 and later)
+    if hasattr(writer, 'compress_identical_objects'):
+        writer.compress_identical_objects()
+    writer.write(path)
+    writer.close()
+
+
+def render_parts(chunks, part_paths, n_workers=1):
+    
+    
+    #render serially for one worker, or when fork() is not available
+    if n_workers <= 1 or len(chunks) < 2 or not CAN_FORK:
+        for chunk, part_path in zip(chunks, part_paths):
+            write_pages(chunk, part_path)
+        return
+    
+    
+    #render each chunk of jobs to its own pdf in the pool
+    chunksize = max(1, len(chunks)//(n_workers*4))
+    with ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        list(pool.map(write_pages, chunks, part_paths, chunksize=chunksize))
+
+
+def render_pdf(jobs, path, n_workers=1):
+    
+    
+    #render serially for one worker, or when pypdf or fork() is not available
+    if n_workers <= 1 or len(jobs) < 2 or PdfWriter is None or not CAN_FORK:
+        write_pages(jobs, path)
+        return
+    
+    
+    #split the jobs into contiguous chunks so the pages keep the well order
+    n_chunks = min(len(jobs), n_workers*4)
+    bounds = np.linspace(0, len(jobs), n_chunks + 1).astype(int)
+    chunks = [jobs[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+    
+    
+    #render the chunks in the pool, then stitch them in order
+    part_dir = tempfile.mkdtemp()
+    part_paths = [os.path.join(part_dir, 'part_{}.pdf'.format(i)) for i in range(n_chunks)]
+    try:
+        render_parts(chunks, part_paths, n_workers)
+        merge_pdfs(part_paths, path)
+    finally:
+        shutil.rmtree(part_dir)
+
+
+# In[ ]:
+
+
+'''define the on-disk cache functions for fits and pages'''
+
+CACHE_VERSION = '1'
+HASH_COLUMNS = ['LOC_NAME', 'Date', 'REPORT_RESULT_VALUE', 'REPORT_RESULT_UNIT', 'INTERPRETED_QUALIFIERS']
+
+def content_key(*parts):
+    
+    #sha256 over the cache version and each part
+    digest = hashlib.sha256(CACHE_VERSION.encode())
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode())
+        digest.update(b'\0')
+    
+    return digest.hexdigest()
+
+
+def well_keys(df, *settings):
+    
+    #hash every row once, then hash the rows of each well in their order
+    row_hashes = pd.util.hash_pandas_object(df[HASH_COLUMNS], index=False).to_numpy()
+    rows = df.groupby('LOC_NAME').indices
+    
+    return {well: content_key(row_hashes[index].tobytes(), *settings) for well, index in rows.items()}
+
+
+def cache_hit(path):
+    
+    #a hit moves the file to the back of the eviction order
+    if not os.path.exists(path):
+        return False
+    os.utime(path)
+    
+    return True
+
+
+def evict_cache(cache_dir, max_bytes):
+    
+    #delete the least recently used files until the cache fits in max_bytes
+    entries = sorted(os.scandir(cache_dir), key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= entry.stat().st_size
+        os.remove(entry.path)
+
+
+def cached_rate_constants(df, duplicates, cache_dir):
+    
+    
+    #find the wells whose results are not in the cache
+    os.makedirs(cache_dir, exist_ok=True)
+    keys = well_keys(df, duplicates)
+    paths = {well: os.path.join(cache_dir, key + '.pkl') for well, key in keys.items()}
+    changed = set(well for well, path in paths.items() if not cache_hit(path))
+    
+    
+    #refit only the changed wells and cache the part of each well
+    parts = []
+    if changed:
+        calc_new, fits_new = rate_constants(df[df['LOC_NAME'].isin(changed)], duplicates=duplicates)
+        for well, calc_part in calc_new.groupby('LOC_NAME'):
+            pd.to_pickle((calc_part, fits_new.loc[[well]]), paths[well])
+        parts.append((calc_new, fits_new))
+    
+    
+    #assemble the calculated values and fits from the cached parts
+    parts += [pd.read_pickle(path) for well, path in paths.items() if well not in changed]
+    if not parts:
+        return rate_constants(df, duplicates=duplicates) + (keys,)
+    calc_df = pd.concat([calc for calc, fits in parts])
+    fits = pd.concat([fits for calc, fits in parts])
+    
+    return calc_df, fits, keys
+
+
+def cached_render_pdf(jobs, page_keys, path, cache_dir, n_workers=1):
+    
+    
+    #the cached pages are stitched with pypdf, without it render the whole pdf
+    if PdfWriter is None:
+        render_pdf(jobs, path, n_workers)
+        return
+    
+    
+    #render only the pages that are not in the cache, one pdf per page
+    page_paths = [os.path.join(cache_dir, key + '.pdf') for key in page_keys]
+    missing = [i for i, page_path in enumerate(page_paths) if not cache_hit(page_path)]
+    render_parts([[jobs[i]] for i in missing], [page_paths[i] for i in missing], n_workers)
+    
+    
+    #stitch the document from the cached pages
+    merge_pdfs(page_paths, path)
+
+
 # In[8]:
 
 
@@ -288,34 +799,57 @@ print(airsparge_dist)
 # In[13]:
 
 
-slopes = []                                                  #accumulate the slopes of Ln(C/C0) vs. Time for each well in well list
-r_squared_values = []                                        #accumulate the r-squared values of Ln(C/C0) vs. Time for each well in well list
+DUPLICATE_RULE = 'all'                                                         #results on one date - 'mean', 'max' or 'all'
+
+
+CACHE_DIR = None                                                               #folder for cached fits and pages, None turns the cache off
+CACHE_MAX_MB = 500                                                             #size of the cache before the oldest files are deleted
+
+
+results_df = out17[out17['LOC_NAME'].isin(well_list)]                         #results of the wells in well_list
+
+if CACHE_DIR is None:
+    calc_df, fits = rate_constants(results_df, duplicates=DUPLICATE_RULE)      #days, Ln(C/C0) and fit for every well at once
+else:
+    calc_df, fits, cache_keys = cached_rate_constants(results_df,              #refit only the wells with new results
+                                                      DUPLICATE_RULE, CACHE_DIR)
+
+
+calc_df = calc_df.assign(Rank = rank_by(calc_df['LOC_NAME'], well_list))       #position of each well in well_list
+calc_df = calc_df.sort_values(['Rank', 'Date'], kind='mergesort')             #order the calculated values by well_list
 
-calculated_df = pd.DataFrame()                               #blank dataframe for the calculated values for each well
+calculated_df = consolidate(calc_df)                                           #clean up the dataframe
+calculated_df.index = calculated_df.groupby('Well_ID').cumcount()              #number the rows of each well from 0
 
 
-index_tracker = 0                                            #track index
+well_groups = calc_df.groupby('LOC_NAME')                                      #calculated values for each well
 
 
-pdf = matplotlib.backends.backend_pdf.PdfPages("Biodeg_Charts_CB_Post2017.pdf") #make the pdf for the graphics
+N_WORKERS = 1                                                                  #processes for rendering the graphics, 1 renders serially
+RECYCLE_FIGURES = False                                                        #update one styled figure for every well instead of building a new one
+COMPACT_PDF = False                                                            #draw the markers as images, text and axes stay vectors - smaller only for dense wells, sparse pdfs grow
+RASTER_DPI = 200                                                               #resolution of the marker images in a compact pdf
 
 
-for well in well_list:
-    df = out17[out17['LOC_NAME'] == well]                     #define subset of master table that is the current well
-    df = column_days(df)                                      #make the days column
-    df = get_C0_column(df)                                    #make the Ln(C/C0) column
-    m, b = solve(df)                                          #solve for slope and y-intercept
-    consolidated_df = consolidate(df)                          #clean up the dataframe
-    calculated_df = calculated_df.append(consolidated_df)     #append the cleaned calculated dataframe to the master df
-    r_squared = r_sqd(df)                                     #solve for R-squared
-    air_dist = airsparge_dist[index_tracker]                  #solve for R-squared
-    graphic = graph(df, well, air_dist, m, b, r_squared)      #render graphic
-    pdf.savefig(graphic)                                      #save the graphic to the pdf
-    slopes.append(m)                                          #append the slopes value 
-    r_squared_values.append(r_squared)                        #append the r_squared value 
-    index_tracker = index_tracker + 1                         #move to the next index position for airsparge_dist
+jobs = []                                                                      #one page per well in well_list order
+page_keys = []                                                                 #cache key of each page
 
-pdf.close()
+for well, air_dist in zip(well_list, airsparge_dist):
+    if well not in well_groups.groups:                                         #skip wells without results
+        continue
+    well_df = well_groups.get_group(well)[['days', 'Ln_conc_c0']]              #calculated values for the current well
+    m, b, r_squared = fits.loc[well, ['Slope', 'Intercept', 'R-Squared']]      #slope, y-intercept and R-squared
+    jobs.append((well_df, well, air_dist, m, b, r_squared))
+    if CACHE_DIR is not None:
+        page_keys.append(content_key(cache_keys[well], air_dist, COMPACT_PDF and RASTER_DPI))
+
+
+if CACHE_DIR is None:
+    render_pdf(jobs, "Biodeg_Charts_CB_Post2017.pdf", N_WORKERS)               #render the graphics to the pdf
+else:
+    cached_render_pdf(jobs, page_keys, "Biodeg_Charts_CB_Post2017.pdf",        #render only the new pages
+                      CACHE_DIR, N_WORKERS)
+    evict_cache(CACHE_DIR, CACHE_MAX_MB*2**20)
     
 
 
@@ -323,11 +857,28 @@ pdf.close()
 
 
 slope_data = {'Well_ID':well_list, 'Airsparge_Distance': airsparge_dist,       #define a dictonary of the data for slope_data_df
-                 'Slope': slopes, 'R-Squared': r_squared_values}
+                 'Slope': fits['Slope'].reindex(well_list).array,
+                 'R-Squared': fits['R-Squared'].reindex(well_list).array}
 
 slope_data_df = pd.DataFrame(slope_data)                                       #make the dataframe
 
 
+TARGET_CONC = 100                                                              #clean up target, chlorobenzene MCL (ug/L)
+CONFIDENCE = 0.95                                                              #confidence level of the clean up date limits
+
+cleanup_df = forecast(calc_df, fits, TARGET_CONC, CONFIDENCE)                   #projected clean up date for every well at once
+slope_data_df = slope_data_df.join(cleanup_df.reindex(well_list).reset_index(drop=True))
+
+
+CENSORED_FIT = False                                                           #set to True to add the censored fit for non-detects
+WEIGHT_COLUMN = None                                                           #result uncertainty column for inverse-variance weights
+
+if CENSORED_FIT:
+    weights = None if WEIGHT_COLUMN is None else inverse_variance_weights(calc_df, WEIGHT_COLUMN)
+    censored_df = solve_censored(calc_df, weights=weights)                     #censored fit of every well at once
+    slope_data_df = slope_data_df.join(censored_df.reindex(well_list).reset_index(drop=True))
+
+
 # In[15]:
 
 
@@ -335,3 +886,70 @@ calculated_df.to_csv('Biodeg_Calc_Table_Master.csv')         #write the calculat
 slope_data_df.to_csv('Rate_Constants_Table.csv')             #write the slope_data_df to csv with other data
 
 
+# In[ ]:
+
+
+'''define the batch function for several COCs and cutoff dates'''
+
+BATCH_KEYS = ['CHEMICAL_NAME', 'Cutoff_Date', 'LOC_NAME']
+
+def batch_rate_constants(df, analytes, cutoff_dates, wells, duplicates='all'):
+    
+    
+    #select the COCs, qualifiers and wells of interest once
+    out = df[df['CHEMICAL_NAME'].isin(analytes) & df['LOC_NAME'].isin(wells)]
+    qualifiers = out['INTERPRETED_QUALIFIERS'].fillna('No Qualifier')
+    out = out[qualifiers.isin(['No Qualifier', 'ND', 'J'])]
+    
+    
+    #stack the results on or after each cutoff date
+    cutoffs = pd.to_datetime(pd.Series(cutoff_dates))
+    stacked = pd.concat([out[out['Date'] >= cutoff].assign(Cutoff_Date = cutoff) for cutoff in cutoffs])
+    
+    
+    #solve every (COC, cutoff, well) group in one pass
+    calc, fits = rate_constants(stacked, BATCH_KEYS, duplicates)
+    fits = fits[FIT_COLUMNS].reset_index()
+    
+    
+    #order the table by COC, cutoff and well as given
+    ranks = [rank_by(fits[key], order) for key, order in zip(BATCH_KEYS, (analytes, cutoffs, wells))]
+    fits = fits.iloc[np.lexsort(ranks[::-1])].reset_index(drop=True)
+    
+    fits = fits.rename(columns= {'CHEMICAL_NAME': 'Analyte', 'LOC_NAME': 'Well_ID'})
+    
+    return fits
+
+
+# In[ ]:
+
+
+'''batch mode - rate constants for several COCs and cutoff dates from one read of the results'''
+
+BATCH_MODE = False                                                             #set to True to run the batch
+ANALYTES = ['Chlorobenzene', 'Benzene', '1,4-Dichlorobenzene']                #COCs in the batch
+CUTOFF_DATES = ['2017-01-01', '2019-01-01']                                    #earliest sample date for each batch
+
+if BATCH_MODE:
+    batch_df = batch_rate_constants(df, ANALYTES, CUTOFF_DATES, well_list, DUPLICATE_RULE)
+    air_dists = pd.Series(airsparge_dist, index=well_list)
+    air_dists = air_dists[~air_dists.index.duplicated()]
+    batch_df.insert(3, 'Airsparge_Distance', batch_df['Well_ID'].map(air_dists))
+    batch_df.to_csv('Rate_Constants_Batch_Table.csv')                           #write the long-format batch table to csv
+
+
+# In[ ]:
+
+
+'''spatial mode - Ln(C) vs. distance from the airsparge line for each sampling event'''
+
+SPATIAL_MODE = False                                                           #set to True to fit each sampling event
+EVENT_FREQ = 'Q'                                                               #sampling event period, quarterly
+
+if SPATIAL_MODE:
+    distances = pd.Series(airsparge_dist, index=well_list)
+    attenuation_df = spatial_attenuation(out1, distances, EVENT_FREQ)          #fit every sampling event at once
+    attenuation_df.to_csv('Spatial_Attenuation_Table.csv')                     #write the attenuation rates to csv
+    graphic = graph_attenuation(attenuation_df)
+    graphic.savefig('Spatial_Attenuation_CB.pdf')                              #save the attenuation rate over time
+    plt.close(graphic)
@@ -20,48 +20,169 @@
 import pandas as pd
 from matplotlib import pyplot as plt 
 import numpy as np
+import base64
 import datetime as datetime
+import hashlib
+import json
 import matplotlib.font_manager as font_manager
 import matplotlib.dates as mdates
 import matplotlib.backends.backend_pdf
+import multiprocessing
+import os
+import shutil
+import tempfile
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from scipy import special
+
+try:
+    from pypdf import PdfWriter                               #only needed to assemble pages rendered in parallel
+except ImportError:
+    PdfWriter = None
 
 
 # In[2]:
 
 
+'''define the wells in the AS/B system and the COCs'''
+
+ASB_WELLS = frozenset(['BW-02', 'CW-1D', 'CW-1S', 'CW-2D', 'CW-2S',
+                       'CW-3D', 'CW-3S', 'CW-4D', 'CW-4S', 'CW-5D',
+                       'CW-5S', 'CW-6D', 'CW-6S', 'CW-7D', 'CW-7S',
+                       'CW-8D', 'CW-8S', 'MW-10', 'MW-11', 'MW-12', 
+                       'MW-13', 'MW-14', 'MW-15', 'MW-16', 'PMW-02',
+                       'PMW-02D', 'PMW-03', 'PMW-03D', 'PMW-04', 'PMW-04D',
+                       'PMW-05', 'PMW-05D', 'PMW-06', 'PMW-06D', 'PMW-07',
+                       'PMW-07D', 'PMW-08D', 'PMW-08S', 'PMW-09D', 'PMW-09S',
+                       'PMW-10D', 'PMW-11D', 'PMW-12D', 'PZ-16R', 'TW-32', 
+                       'TW-42', 'TW-45', 'TW-46', 'TW-71D', 'TW-71S',
+                       'TW-73', 'TW-75', 'TW-84', 'TW-44', 'TW-102',
+                       'TW-29', 'TW-27R', 'TW-28', 'BW-05'])
+
+ANALYTES = ['Chlorobenzene', 'Benzene', '1,4-Dichlorobenzene']
+
+MCLS = {'Chlorobenzene': 100, 'Benzene': 5, '1,4-Dichlorobenzene': 75}     #µg/L
+
+NO_RESULTS = (np.array([], dtype='datetime64[ns]'), np.array([], dtype=float))
+
+NO_RUN = NO_RESULTS + (np.array([], dtype=bool),)
+
+
+'''define function to partition the export by well and COC'''
+
+def partition_results(df):
+    
+    #sort once so the results of each well and COC are a contiguous run of dates
+    df = df[df['CHEMICAL_NAME'].isin(ANALYTES)]
+    df = df.sort_values(['LOC_NAME', 'CHEMICAL_NAME', 'SAMPLE_DATE'], kind='mergesort')
+    wells = df['LOC_NAME'].to_numpy()
+    chemicals = df['CHEMICAL_NAME'].to_numpy()
+    dates = df['SAMPLE_DATE'].to_numpy()
+    results = df['REPORT_RESULT_VALUE'].to_numpy(dtype=float)
+    non_detects = (df['INTERPRETED_QUALIFIERS'] == 'ND').to_numpy()
+    
+    #find where each run starts and stops
+    new_run = np.ones(len(df), dtype=bool)
+    new_run[1:] = (wells[1:] != wells[:-1]) | (chemicals[1:] != chemicals[:-1])
+    starts = np.flatnonzero(new_run)
+    stops = np.append(starts[1:], len(df))
+    
+    #index the (dates, results, non_detects) of each run by (well, COC)
+    index = {}
+    for start, stop in zip(starts, stops):
+        index[(wells[start], chemicals[start])] = (dates[start:stop], results[start:stop], non_detects[start:stop])
+    
+    return index
+
+
+'''define function to summarize the results and MCL exceedances of each well and COC'''
+
+def summary_table(df, labels):
+    
+    #sort once so the last result of each well and COC is the latest
+    df = df[df['CHEMICAL_NAME'].isin(ANALYTES)].sort_values('SAMPLE_DATE', kind='mergesort')
+    
+    #a non-detect stores its reporting limit, so only detected results above the MCL are exceedances
+    mcl = df['CHEMICAL_NAME'].map(MCLS)
+    non_detect = df['INTERPRETED_QUALIFIERS'] == 'ND'
+    exceeds = (df['REPORT_RESULT_VALUE'] > mcl) & ~non_detect
+    df = df.assign(MCL=mcl, Non_Detect=non_detect, Detected=df['REPORT_RESULT_VALUE'].where(~non_detect),
+                   Exceeds=exceeds, Exceedance_Date=df['SAMPLE_DATE'].where(exceeds))
+    
+    #one grouped pass over the export - the maximum is of the detected results, the latest result may be a reporting limit
+    summary = df.groupby(['LOC_NAME', 'CHEMICAL_NAME']).agg(N_Samples=('REPORT_RESULT_VALUE', 'count'),
+                                                           N_Non_Detects=('Non_Detect', 'sum'),
+                                                           Max_Result=('Detected', 'max'),
+                                                           Latest_Date=('SAMPLE_DATE', 'last'),
+                                                           Latest_Result=('REPORT_RESULT_VALUE', 'last'),
+                                                           Latest_Non_Detect=('Non_Detect', 'last'),
+                                                           MCL=('MCL', 'first'),
+                                                           Exceedances=('Exceeds', 'sum'),
+                                                           Last_Exceedance_Date=('Exceedance_Date', 'max'))
+    
+    #label with the figure of each well, in figure order
+    summary = labels.merge(summary.reset_index(), left_on='LOCID', right_on='LOC_NAME')
+    
+    return summary.drop(columns='LOC_NAME')
+
+
+'''define function to downsample a dense series, keeping its shape, maximum and MCL exceedances'''
+
+def downsample(dates, results, non_detects, max_points, mcl):
+    
+    n = len(results)
+    if max_points is None or n <= max_points:
+        return dates, results
+    
+    #split the series into buckets of consecutive results
+    n_buckets = max(1, max_points//4)
+    bucket = np.arange(n)*n_buckets//n
+    starts = np.searchsorted(bucket, np.arange(n_buckets))
+    stops = np.append(starts[1:], n)
+    
+    #keep the first, last, lowest and highest result of each bucket
+    order = np.lexsort((np.where(np.isnan(results), -np.inf, results), bucket))
+    keep = np.zeros(n, dtype=bool)
+    keep[starts] = True
+    keep[stops - 1] = True
+    keep[order[starts]] = True
+    keep[order[stops - 1]] = True
+    
+    #always keep the maximum result and every MCL exceedance - a non-detect stores its reporting limit, not an exceedance
+    if np.isfinite(results).any():
+        keep[np.nanargmax(results)] = True
+    keep |= (results > mcl) & ~non_detects
+    
+    return dates[keep], results[keep]
+
+
+'''define function to get the CB, BZ and DB results of a well'''
+
+def well_series(index, well_id, max_points=None):
+    
+    #Define analyte data from the partitioned results
+    series = [index.get((well_id, chemical), NO_RUN) for chemical in ANALYTES]
+    
+    #Start at 2009 when the results go back further
+    full_daterange = np.concatenate([dates for dates, results, non_detects in series])
+    if len(full_daterange) and full_daterange.min() < np.datetime64('2009-01-01'):
+        series = [(dates[dates >= np.datetime64('2009-01-01')], results[dates >= np.datetime64('2009-01-01')],
+                   non_detects[dates >= np.datetime64('2009-01-01')])
+                  for dates, results, non_detects in series]
+    
+    #Downsample dense series to about max_points results
+    series = [downsample(dates, results, non_detects, max_points, MCLS[chemical])
+              for (dates, results, non_detects), chemical in zip(series, ANALYTES)]
+    
+    return series
+
+
 '''define graphics function - natural scale'''
 
-def graph(df, fig_id, well_id, plume_loc):
-    
-    #Define analyte data from the master dataframe
-    CB = df[df['CHEMICAL_NAME'] == 'Chlorobenzene']
-    BZ = df[df['CHEMICAL_NAME'] == 'Benzene']
-    DB = df[df['CHEMICAL_NAME'] == '1,4-Dichlorobenzene']
-    
-    ASB_list = ['BW-02', 'CW-1D', 'CW-1S', 'CW-2D', 'CW-2S',
-                'CW-3D', 'CW-3S', 'CW-4D', 'CW-4S', 'CW-5D',
-                'CW-5S', 'CW-6D', 'CW-6S', 'CW-7D', 'CW-7S',
-                'CW-8D', 'CW-8S', 'MW-10', 'MW-11', 'MW-12', 
-                'MW-13', 'MW-14', 'MW-15', 'MW-16', 'PMW-02',
-                'PMW-02D', 'PMW-03', 'PMW-03D', 'PMW-04', 'PMW-04D',
-                'PMW-05', 'PMW-05D', 'PMW-06', 'PMW-06D', 'PMW-07',
-                'PMW-07D', 'PMW-08D', 'PMW-08S', 'PMW-09D', 'PMW-09S',
-                'PMW-10D', 'PMW-11D', 'PMW-12D', 'PZ-16R', 'TW-32', 
-                'TW-42', 'TW-45', 'TW-46', 'TW-71D', 'TW-71S',
-                'TW-73', 'TW-75', 'TW-84', 'TW-44', 'TW-102',
-                'TW-29', 'TW-27R', 'TW-28', 'BW-05']
-    
-    #Define min and max dates of the lab results
-    date_range1= np.append( BZ['SAMPLE_DATE'].array, CB['SAMPLE_DATE'].array)
-    full_daterange = np.append(date_range1, DB['SAMPLE_DATE'].array)
-    try:
-        min_date = full_daterange.min()
-        if min_date < np.datetime64('2009-01-01'):
-            CB = CB[CB['SAMPLE_DATE'] >= datetime.datetime(2009,1,1)]
-            BZ = BZ[BZ['SAMPLE_DATE'] >= datetime.datetime(2009,1,1)]
-            DB = DB[DB['SAMPLE_DATE'] >= datetime.datetime(2009,1,1)]
-    except ValueError:
-        pass
+def graph(series, fig_id, well_id, plume_loc):
+    
+    #Define analyte data - (dates, results) of each COC from well_series()
+    (cb_dates, cb_results), (bz_dates, bz_results), (db_dates, db_results) = series
 
     #Create figure and axes objects
     fig = plt.figure(figsize=(14,10))
@@ -69,8 +190,8 @@ def graph(df, fig_id, well_id, plume_loc):
     ax2 =ax1.twinx() #secondary axis
     
     #Graph contaminant trends - primary axis
-    ax1.plot(DB['SAMPLE_DATE'], DB['REPORT_RESULT_VALUE'], marker = 'D', color = 'blue') #plot 1,4-Dichlorobenzene
-    ax1.plot(BZ['SAMPLE_DATE'], BZ['REPORT_RESULT_VALUE'], marker = 's', color = 'green') #plot Benzene
+    ax1.plot(db_dates, db_results, marker = 'D', color = 'blue') #plot 1,4-Dichlorobenzene
+    ax1.plot(bz_dates, bz_results, marker = 's', color = 'green') #plot Benzene
     
     #define font for the legend
     font = font_manager.FontProperties(family='Arial', size=11)
@@ -80,10 +201,10 @@ def graph(df, fig_id, well_id, plume_loc):
                prop=font)
     
     #Graph contaminant trends - secondary axis    
-    ax2.plot(CB['SAMPLE_DATE'], CB['REPORT_RESULT_VALUE'], marker = '^', color = 'orange') #plot Chlorobenzene
+    ax2.plot(cb_dates, cb_results, marker = '^', color = 'orange') #plot Chlorobenzene
     
     #Graph AS/B Long-Term Operations Start - secondary axis (if applicable)
-    if well_id in ASB_list:
+    if well_id in ASB_WELLS:
         ax2.axvline( x =datetime.datetime(2018,5,20), color = 'brown')
         legend2 = ax2.legend(['Chlorobenzene', 'AS/B Long-Term Operations Start'], loc =(0.14, -0.15), #plot legend
                          prop=font)
@@ -109,13 +230,13 @@ def graph(df, fig_id, well_id, plume_loc):
     ax1.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d/%Y'))
     ax2.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d/%Y'))
     
-    #Add title
-    plt.title("Figure B-" + str(fig_id) + "\n" + str(well_id) +" " + str(plume_loc) + " Concentration vs. Time",
-             fontsize =14, fontweight = 'semibold', fontfamily = 'Arial')
-    
     #Annotate with the MCLs    
     ax2.annotate( r"$\bf{"+ "MCLs:"+ "}$" + '\nChlorobenzene = 100 µg/L\nBenzene = 5 µg/L\n1,4-Dichlorobenzene = 75 µg/L', 
                  (700,10), xycoords = 'figure points', fontsize=10)
+    
+    #Annotate with the Mann-Kendall trends (if applicable)
+    if well_id in trend_notes:
+        ax2.annotate(trend_notes[well_id], (10,710), xycoords = 'figure points', fontsize=10, va = 'top')
            
     #Adjust x axis tick label orientation and size
     for tick in ax1.get_xticklabels():
@@ -123,32 +244,12 @@ def graph(df, fig_id, well_id, plume_loc):
         tick.set_fontfamily("Arial")
         tick.set_fontweight("semibold")
         tick.set_rotation(20)
-    
-    #Set font properties for y axis ticks - primary axis
-    for tick in ax1.get_yticklabels():
-        tick.set_fontsize(12)
-        tick.set_fontfamily("Arial")
-        tick.set_fontweight("semibold")
-        
-    #Set font properties for y axis ticks - secondary axis
-    for tick in ax2.get_yticklabels():
-        tick.set_fontsize(12)
-        tick.set_fontfamily("Arial")
-        tick.set_fontweight("semibold")
 
     #Add Horizontal Gridlines
     ax1.grid(axis = 'y', which='major', color='black')
     
-    try:
-        #Define maximum results to set the upper y-axis limit
-        ax1_max = (np.append(DB['REPORT_RESULT_VALUE'].array, BZ['REPORT_RESULT_VALUE'].array).max())
-        ax2_max = CB['REPORT_RESULT_VALUE'].max()
-
-        #set axes scale
-        ax1.set_ylim([0, ax1_max +(ax1_max*0.05)])
-        ax2.set_ylim([0, ax2_max + (ax2_max*0.05)])
-    except ValueError:
-        pass
+    #Add title, y-axis scale and limits
+    set_scale(fig, fig_id, well_id, plume_loc, log_scale=False)
     
     return fig
 
@@ -156,48 +257,79 @@ def graph(df, fig_id, well_id, plume_loc):
 # In[3]:
 
 
+'''define function to set the y-axis scale of a figure from graph()'''
+
+def set_scale(fig, fig_id, well_id, plume_loc, log_scale):
+    
+    ax1, ax2 = fig.axes
+    
+    #Add title
+    title = " Log Scale" if log_scale else ""
+    ax2.set_title("Figure B-" + str(fig_id) + title + "\n" + str(well_id) +" " + str(plume_loc) + " Concentration vs. Time",
+                  fontsize =14, fontweight = 'semibold', fontfamily = 'Arial')
+    
+    #Apply the scale and limits
+    scale_axes(ax1, ax2, log_scale)
+    
+    #Set font properties for y axis ticks - primary and secondary axes
+    for tick in ax1.get_yticklabels() + ax2.get_yticklabels():
+        tick.set_fontsize(12)
+        tick.set_fontfamily("Arial")
+        tick.set_fontweight("semibold")
+
+
+'''define function to set the y-axis scale and limits of a primary and secondary axis pair'''
+
+def scale_axes(ax1, ax2, log_scale):
+    
+    #Define the scale, lower y-axis limit and headroom
+    if log_scale:
+        scale, y_min, headroom = 'log', 0.1, 0.1
+    else:
+        scale, y_min, headroom = 'linear', 0, 0.05
+    
+    #Define maximum results from the plotted lines - 1,4-DCB and benzene on primary, chlorobenzene on secondary
+    ax1_results = np.concatenate([np.asarray(line.get_ydata(), dtype=float) for line in ax1.get_lines()])
+    ax2_results = np.asarray(ax2.get_lines()[0].get_ydata(), dtype=float)
+    
+    #Apply the scale and set the upper y-axis limit - a log axis without a positive result cannot autoscale, so it shows one decade
+    for ax, results in ((ax1, ax1_results), (ax2, ax2_results)):
+        ax.set_yscale(scale)
+        if log_scale and not (results > 0).any():
+            ax.set_ylim([y_min, 10*y_min])
+        else:
+            ax.autoscale(axis='y')
+            if np.isfinite(results).any():
+                ax_max = np.nanmax(results)
+                ax.set_ylim([y_min, ax_max + (ax_max*headroom)])
+
+
 '''define graphics function - log scale'''
 
-def graph_log_scale(df, fig_id, well_id, plume_loc):
-    
-    #Define analyte data from the master dataframe
-    CB = df[df['CHEMICAL_NAME'] == 'Chlorobenzene']
-    BZ = df[df['CHEMICAL_NAME'] == 'Benzene']
-    DB = df[df['CHEMICAL_NAME'] == '1,4-Dichlorobenzene']
-    
-    ASB_list = ['BW-02', 'CW-1D', 'CW-1S', 'CW-2D', 'CW-2S',
-                'CW-3D', 'CW-3S', 'CW-4D', 'CW-4S', 'CW-5D',
-                'CW-5S', 'CW-6D', 'CW-6S', 'CW-7D', 'CW-7S',
-                'CW-8D', 'CW-8S', 'MW-10', 'MW-11', 'MW-12', 
-                'MW-13', 'MW-14', 'MW-15', 'MW-16', 'PMW-02',
-                'PMW-02D', 'PMW-03', 'PMW-03D', 'PMW-04', 'PMW-04D',
-                'PMW-05', 'PMW-05D', 'PMW-06', 'PMW-06D', 'PMW-07',
-                'PMW-07D', 'PMW-08D', 'PMW-08S', 'PMW-09D', 'PMW-09S',
-                'PMW-10D', 'PMW-11D', 'PMW-12D', 'PZ-16R', 'TW-32', 
-                'TW-42', 'TW-45', 'TW-46', 'TW-71D', 'TW-71S',
-                'TW-73', 'TW-75', 'TW-84', 'TW-44', 'TW-102',
-                'TW-29', 'TW-27R', 'TW-28', 'BW-05']
-    
-    #Define min and max dates of the lab results
-    date_range1= np.append( BZ['SAMPLE_DATE'].array, CB['SAMPLE_DATE'].array)
-    full_daterange = np.append(date_range1, DB['SAMPLE_DATE'].array)
-    try:
-        min_date = full_daterange.min()
-        if min_date < np.datetime64('2009-01-01'):
-            CB = CB[CB['SAMPLE_DATE'] >= datetime.datetime(2009,1,1)]
-            BZ = BZ[BZ['SAMPLE_DATE'] >= datetime.datetime(2009,1,1)]
-            DB = DB[DB['SAMPLE_DATE'] >= datetime.datetime(2009,1,1)]
-    except ValueError:
-        pass
+def graph_log_scale(series, fig_id, well_id, plume_loc):
+    
+    fig = graph(series, fig_id, well_id, plume_loc)
+    set_scale(fig, fig_id, well_id, plume_loc, log_scale=True)
+    
+    return fig
 
+
+# In[ ]:
+
+
+'''define the reusable figure template - styled once, then updated for each well'''
+
+def graph_template():
+    
     #Create figure and axes objects
     fig = plt.figure(figsize=(14,10))
     ax1 = plt.subplot(1,1,1) #primary axis
     ax2 =ax1.twinx() #secondary axis
+    no_dates = NO_RESULTS[0]
     
-    #Graph contaminant trends - primary axis
-    ax1.plot(DB['SAMPLE_DATE'], DB['REPORT_RESULT_VALUE'], marker = 'D', color = 'blue') #plot 1,4-Dichlorobenzene
-    ax1.plot(BZ['SAMPLE_DATE'], BZ['REPORT_RESULT_VALUE'], marker = 's', color = 'green') #plot Benzene
+    #Graph contaminant trends without data - primary axis
+    db_line, = ax1.plot(no_dates, [], marker = 'D', color = 'blue') #plot 1,4-Dichlorobenzene
+    bz_line, = ax1.plot(no_dates, [], marker = 's', color = 'green') #plot Benzene
     
     #define font for the legend
     font = font_manager.FontProperties(family='Arial', size=11)
@@ -206,20 +338,17 @@ def graph_log_scale(df, fig_id, well_id, plume_loc):
     ax1.legend(['1,4-Dichlorobenzene', 'Benzene'], loc =(-0.08, -0.15),
                prop=font)
     
-    #Graph contaminant trends - secondary axis    
-    ax2.plot(CB['SAMPLE_DATE'], CB['REPORT_RESULT_VALUE'], marker = '^', color = 'orange') #plot Chlorobenzene
-
-    #Graph AS/B Long-Term Operations Start - secondary axis
-    if well_id in ASB_list:
-        ax2.axvline( x =datetime.datetime(2018,5,20), color = 'brown')
-        legend2 = ax2.legend(['Chlorobenzene', 'AS/B Long-Term Operations Start'], loc =(0.14, -0.15),
-                         prop=font)
-        plt.gca().add_artist(legend2)
-    else:
-        legend2 = ax2.legend(['Chlorobenzene'], loc =(0.14, -0.15),
-                         prop=font)
-        plt.gca().add_artist(legend2)
-                              
+    #Graph contaminant trends without data - secondary axis    
+    cb_line, = ax2.plot(no_dates, [], marker = '^', color = 'orange') #plot Chlorobenzene
+    
+    #Graph AS/B Long-Term Operations Start with both legends, shown per well
+    asb_line = ax2.axvline( x =datetime.datetime(2018,5,20), color = 'brown')
+    asb_legend = ax2.legend([cb_line, asb_line], ['Chlorobenzene', 'AS/B Long-Term Operations Start'],
+                            loc =(0.14, -0.15), prop=font)
+    ax2.add_artist(asb_legend)
+    cb_legend = ax2.legend([cb_line], ['Chlorobenzene'], loc =(0.14, -0.15), prop=font)
+    ax2.add_artist(cb_legend)
+    
     #Label x-axis
     ax1.set_xlabel('Sampling Date', fontsize=14, 
                    fontweight = 'semibold', fontfamily = 'Arial')
@@ -236,54 +365,751 @@ def graph_log_scale(df, fig_id, well_id, plume_loc):
     ax1.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d/%Y'))
     ax2.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d/%Y'))
     
-    #Apply log scale to primary and secondary axes
-    ax1.set_yscale('log')
-    ax2.set_yscale('log')
-    
-    #Add title
-    plt.title("Figure B-" + str(fig_id) + " Log Scale\n" + str(well_id) +" " + str(plume_loc) + " Concentration vs. Time",
-             fontsize =14, fontweight = 'semibold', fontfamily = 'Arial')
-        
-
     #Annotate with the MCLs    
     ax2.annotate( r"$\bf{"+ "MCLs:"+ "}$" + '\nChlorobenzene = 100 µg/L\nBenzene = 5 µg/L\n1,4-Dichlorobenzene = 75 µg/L', 
                  (700,10), xycoords = 'figure points', fontsize=10)
+    
+    #Annotate with the Mann-Kendall trends, filled in per well
+    trend_note = ax2.annotate('', (10,710), xycoords = 'figure points', fontsize=10, va = 'top')
            
-    #Adjust x axis tick label orientation and size
+    #Adjust x axis tick label orientation and size, new ticks copy the first tick's style
     for tick in ax1.get_xticklabels():
         tick.set_fontsize(12)
         tick.set_fontfamily("Arial")
         tick.set_fontweight("semibold")
         tick.set_rotation(20)
-    
-    #Set font properties for y axis ticks - primary axis
-    for tick in ax1.get_yticklabels():
-        tick.set_fontsize(12)
-        tick.set_fontfamily("Arial")
-        tick.set_fontweight("semibold")
-        
-    #Set font properties for y axis ticks - secondary axis
-    for tick in ax2.get_yticklabels():
-        tick.set_fontsize(12)
-        tick.set_fontfamily("Arial")
-        tick.set_fontweight("semibold")
 
     #Add Horizontal Gridlines
     ax1.grid(axis = 'y', which='major', color='black')
     
-    #Define maximum results to set the upper y-axis limit
-    try:
-        ax1_max = (np.append(DB['REPORT_RESULT_VALUE'].array, BZ['REPORT_RESULT_VALUE'].array).max())
-        ax2_max = CB['REPORT_RESULT_VALUE'].max()
-        #set axes scale
-        ax1.set_ylim([0.1, ax1_max +(ax1_max*0.1)])
-        ax2.set_ylim([0.1, ax2_max + (ax2_max*0.1)])
-    except ValueError:
-        pass
+    template = {'fig': fig, 'lines': (cb_line, bz_line, db_line), 'asb_line': asb_line,
+                'asb_legend': asb_legend, 'cb_legend': cb_legend, 'trend_note': trend_note}
+    return template
+
+
+def update_graph(template, series, fig_id, well_id, plume_loc):
+    
+    fig = template['fig']
+    ax1, ax2 = fig.axes
+    
+    #Update the CB, BZ and DB lines with the results of this well
+    for line, (dates, results) in zip(template['lines'], series):
+        line.set_data(dates, results)
+    
+    #Show the AS/B Long-Term Operations Start and its legend for AS/B wells
+    asb = well_id in ASB_WELLS
+    template['asb_line'].set_visible(asb)
+    template['asb_legend'].set_visible(asb)
+    template['cb_legend'].set_visible(not asb)
+    
+    #Show the Mann-Kendall trends of the well (if applicable)
+    template['trend_note'].set_text(trend_notes.get(well_id, ''))
+    
+    #Rescale the x-axis to the visible data
+    for ax in (ax1, ax2):
+        ax.relim(visible_only=True)
+        ax.autoscale_view()
+    
+    #Add title, y-axis scale and limits
+    set_scale(fig, fig_id, well_id, plume_loc, log_scale=False)
     
     return fig
 
 
+recycled = {}
+
+def recycled_template():
+    
+    #one template per process, so peak memory stays at one figure
+    if 'template' not in recycled:
+        recycled['template'] = graph_template()
+    
+    return recycled['template']
+
+
+# In[ ]:
+
+
+'''define functions to render the graphics into the normal and log scale pdfs'''
+
+CAN_FORK = 'fork' in multiprocessing.get_all_start_methods()
+
+#compact pdfs only pay off for dense series - a marker image costs more than a few vector markers
+COMPACT_RC = {'pdf.compression': 9}     #maximum stream compression, the default Type 3 fonts are already subset
+
+def rasterize_markers(fig, rasterized=True):
+    
+    #draw the lines with markers as images, the text, axes and AS/B line stay vectors
+    for ax in fig.axes:
+        for line in ax.get_lines():
+            if line.get_marker() not in (None, '', 'None'):
+                line.set_rasterized(rasterized)
+
+
+def write_pages(jobs, normal_path, log_path):
+    
+    #compact pages draw the markers as images at RASTER_DPI
+    options = {'dpi': RASTER_DPI} if COMPACT_PDF else {}
+    
+    #render one normal and one log page per (series, fig_id, well_id, plume_loc) job
+    with plt.rc_context(COMPACT_RC if COMPACT_PDF else {}):
+        pdf_normal_scale = matplotlib.backends.backend_pdf.PdfPages(normal_path + '.tmp')
+        pdf_log_scale = matplotlib.backends.backend_pdf.PdfPages(log_path + '.tmp')
+        for series, fig_id, well_id, plume_loc in jobs:
+            if RECYCLE_FIGURES:
+                fig = update_graph(recycled_template(), series, fig_id, well_id, plume_loc)
+            else:
+                fig = graph(series, fig_id, well_id, plume_loc)
+            rasterize_markers(fig, COMPACT_PDF)
+            pdf_normal_scale.savefig(fig, **options)
+            set_scale(fig, fig_id, well_id, plume_loc, log_scale=True)
+            pdf_log_scale.savefig(fig, **options)
+            if not RECYCLE_FIGURES:
+                plt.close(fig)
+        pdf_normal_scale.close()
+        pdf_log_scale.close()
+    
+    #only complete pdfs take the final names
+    os.replace(normal_path + '.tmp', normal_path)
+    os.replace(log_path + '.tmp', log_path)
+
+
+def merge_pdfs(part_paths, path):
+    
+    #stitch the part pdfs together in the order given
+    writer = PdfWriter()
+    for part_path in part_paths:
+        writer.append(part_path)
+    
+    #drop the font copies embedded by each part (pypdf 4.3 and later)
+    if hasattr(writer, 'compress_identical_objects'):
+        writer.compress_identical_objects()
+    writer.write(path)
+    writer.close()
+
+
+def render_parts(chunks, normal_paths, log_paths, n_workers=1):
+    
+    
+    #render serially for one worker, or when fork() is not available
+    if n_workers <= 1 or len(chunks) < 2 or not CAN_FORK:
+        for chunk, normal_path, log_path in zip(chunks, normal_paths, log_paths):
+            write_pages(chunk, normal_path, log_path)
+        return
+    
+    
+    #render each chunk of jobs to its own pair of pdfs in the pool
+    chunksize = max(1, len(chunks)//(n_workers*4))
+    with ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        list(pool.map(write_pages, chunks, normal_paths, log_paths, chunksize=chunksize))
+
+
+def render_pdfs(jobs, normal_path, log_path, n_workers=1):
+    
+    
+    #render serially for one worker, or when pypdf or fork() is not available
+    if n_workers <= 1 or len(jobs) < 2 or PdfWriter is None or not CAN_FORK:
+        write_pages(jobs, normal_path, log_path)
+        return
+    
+    
+    #split the jobs into contiguous chunks so the pages keep the figure order
+    n_chunks = min(len(jobs), n_workers*4)
+    bounds = np.linspace(0, len(jobs), n_chunks + 1).astype(int)
+    chunks = [jobs[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+    
+    
+    #render the chunks in the pool, then stitch each scale in order
+    part_dir = tempfile.mkdtemp()
+    normal_parts = [os.path.join(part_dir, 'normal_{}.pdf'.format(i)) for i in range(n_chunks)]
+    log_parts = [os.path.join(part_dir, 'log_{}.pdf'.format(i)) for i in range(n_chunks)]
+    try:
+        render_parts(chunks, normal_parts, log_parts, n_workers)
+        merge_pdfs(normal_parts, normal_path)
+        merge_pdfs(log_parts, log_path)
+    finally:
+        shutil.rmtree(part_dir)
+
+
+# In[ ]:
+
+
+'''define the small-multiples overview - one figure of rows x cols wells, reused for every page'''
+
+def overview_template(rows, cols):
+    
+    #Create figure and axes objects
+    fig, axes = plt.subplots(rows, cols, figsize=(14,10), squeeze=False)
+    fig.subplots_adjust(left=0.07, right=0.93, top=0.92, bottom=0.13, hspace=0.45, wspace=0.4)
+    no_dates = NO_RESULTS[0]
+    
+    #Graph contaminant trends without data in each panel - 1,4-DCB and benzene on primary, chlorobenzene on secondary
+    panels = []
+    for ax1 in axes.flat:
+        ax2 = ax1.twinx()
+        db_line, = ax1.plot(no_dates, [], marker = 'D', markersize = 3, color = 'blue')
+        bz_line, = ax1.plot(no_dates, [], marker = 's', markersize = 3, color = 'green')
+        cb_line, = ax2.plot(no_dates, [], marker = '^', markersize = 3, color = 'orange')
+        asb_line = ax2.axvline( x =datetime.datetime(2018,5,20), color = 'brown')
+        
+        #edit axes format
+        ax1.xaxis.set_major_locator(mdates.AutoDateLocator(minticks = 3, maxticks = 5))
+        ax1.xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
+        ax1.grid(axis = 'y', which='major', color='black', linewidth = 0.5)
+        for ax in (ax1, ax2):
+            ax.tick_params(labelsize = 8)
+        
+        panels.append({'axes': (ax1, ax2), 'lines': (cb_line, bz_line, db_line), 'asb_line': asb_line})
+    
+    #Add one legend for every panel
+    font = font_manager.FontProperties(family='Arial', size=11)
+    fig.legend([db_line, bz_line, cb_line, asb_line],
+               ['1,4-Dichlorobenzene', 'Benzene', 'Chlorobenzene', 'AS/B Long-Term Operations Start'],
+               loc = 'lower left', bbox_to_anchor = (0.05, 0.01), ncol = 2, prop=font)
+    
+    #Label y-axes
+    fig.text(0.01, 0.5, '1,4-Dichlorobenzene and Benzene Concentration (µg/L)', rotation = 'vertical', va = 'center',
+             fontsize =12, fontweight = 'semibold', fontfamily = 'Arial')
+    fig.text(0.985, 0.5, 'Chlorobenzene Concentration (µg/L)', rotation = 'vertical', va = 'center',
+             fontsize =12, fontweight = 'semibold', fontfamily = 'Arial')
+    
+    #Annotate with the MCLs
+    fig.text(0.7, 0.015, r"$\bf{"+ "MCLs:"+ "}$" + '\nChlorobenzene = 100 µg/L\nBenzene = 5 µg/L\n1,4-Dichlorobenzene = 75 µg/L',
+             fontsize=10)
+    
+    title = fig.suptitle('', fontsize =14, fontweight = 'semibold', fontfamily = 'Arial')
+    
+    template = {'fig': fig, 'panels': panels, 'title': title}
+    return template
+
+
+def update_overview(template, jobs, log_scale):
+    
+    #Fill a panel for each (series, fig_id, well_id, plume_loc) job, hide the panels left over
+    for i, panel in enumerate(template['panels']):
+        ax1, ax2 = panel['axes']
+        ax1.set_visible(i < len(jobs))
+        ax2.set_visible(i < len(jobs))
+        if i >= len(jobs):
+            continue
+        series, fig_id, well_id, plume_loc = jobs[i]
+        
+        #Update the CB, BZ and DB lines and the AS/B start with the results of this well
+        for line, (dates, results) in zip(panel['lines'], series):
+            line.set_data(dates, results)
+        panel['asb_line'].set_visible(well_id in ASB_WELLS)
+        ax2.set_title("B-" + str(fig_id) + " " + str(well_id), fontsize =10, fontweight = 'semibold', fontfamily = 'Arial')
+        
+        #Rescale the x-axis to the visible data, then set the y-axis scale and limits
+        for ax in (ax1, ax2):
+            ax.relim(visible_only=True)
+            ax.autoscale_view()
+        scale_axes(ax1, ax2, log_scale)
+    
+    #Add title
+    title = " - Log Scale" if log_scale else ""
+    template['title'].set_text("Concentration vs. Time, Figures B-" + str(jobs[0][1]) + " to B-" + str(jobs[-1][1]) + title)
+    
+    return template['fig']
+
+
+def write_overview(jobs, path, grid, log_scale):
+    
+    #render rows x cols wells per page on one figure
+    rows, cols = grid
+    options = {'dpi': RASTER_DPI} if COMPACT_PDF else {}
+    with plt.rc_context(COMPACT_RC if COMPACT_PDF else {}):
+        template = overview_template(rows, cols)
+        pdf = matplotlib.backends.backend_pdf.PdfPages(path + '.tmp')
+        for start in range(0, len(jobs), rows*cols):
+            fig = update_overview(template, jobs[start:start + rows*cols], log_scale)
+            rasterize_markers(fig, COMPACT_PDF)
+            pdf.savefig(fig, **options)
+        pdf.close()
+        plt.close(template['fig'])
+    
+    #only a complete pdf takes the final name
+    os.replace(path + '.tmp', path)
+
+
+# In[ ]:
+
+
+'''define the on-disk page cache functions'''
+
+CACHE_VERSION = '2'
+
+def content_key(*parts):
+    
+    #sha256 over the cache version and each part
+    digest = hashlib.sha256(CACHE_VERSION.encode())
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode())
+        digest.update(b'\0')
+    
+    return digest.hexdigest()
+
+
+def page_key(series, fig_id, well_id, plume_loc, log_scale):
+    
+    #hash the plotted results of the well with everything that labels its page
+    results = [array.tobytes() for dates, results in series for array in (dates, results)]
+    
+    return content_key(*results, fig_id, well_id, plume_loc, well_id in ASB_WELLS, trend_notes.get(well_id), log_scale,
+                       COMPACT_PDF and RASTER_DPI)
+
+
+def cache_hit(path):
+    
+    #a hit moves the file to the back of the eviction order
+    if not os.path.exists(path):
+        return False
+    os.utime(path)
+    
+    return True
+
+
+def evict_cache(cache_dir, max_bytes):
+    
+    #delete the least recently used files until the cache fits in max_bytes
+    entries = sorted(os.scandir(cache_dir), key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= entry.stat().st_size
+        os.remove(entry.path)
+
+
+def cached_render_pdfs(jobs, normal_path, log_path, cache_dir, n_workers=1):
+    
+    
+    #the cached pages are stitched with pypdf, without it render both whole pdfs
+    os.makedirs(cache_dir, exist_ok=True)
+    if PdfWriter is None:
+        render_pdfs(jobs, normal_path, log_path, n_workers)
+        return
+    
+    
+    #find the cached normal and log page of each job
+    normal_pages = [os.path.join(cache_dir, page_key(*job, log_scale=False) + '.pdf') for job in jobs]
+    log_pages = [os.path.join(cache_dir, page_key(*job, log_scale=True) + '.pdf') for job in jobs]
+    
+    
+    #render the missing or stale pages, one pdf per page - & touches both pages of a job
+    missing = [i for i in range(len(jobs)) if not (cache_hit(normal_pages[i]) & cache_hit(log_pages[i]))]
+    render_parts([[jobs[i]] for i in missing], [normal_pages[i] for i in missing],
+                 [log_pages[i] for i in missing], n_workers)
+    
+    
+    #stitch both documents from the cached pages
+    merge_pdfs(normal_pages, normal_path)
+    merge_pdfs(log_pages, log_path)
+
+
+# In[ ]:
+
+
+'''define the Mann-Kendall trend test - short series at once as padded arrays, long series in tiles of pairs'''
+
+def tiled_mann_kendall(t, y, block_size):
+    
+    
+    #drop the missing results, then compare about block_size pairs at a time - each row i against every later j
+    t, y = t[~np.isnan(y)], y[~np.isnan(y)]
+    n = len(y)
+    rows = max(1, block_size//max(n, 1))
+    
+    def tiles():
+        for start in range(0, n, rows):
+            i = np.arange(start, min(start + rows, n))[:, None]
+            later = np.arange(n) > i
+            yield (t - t[i])[later], (y - y[i])[later]
+    
+    def slope_tiles():
+        for dt, dy in tiles():
+            yield dy[dt != 0]/dt[dt != 0]
+    
+    
+    #S statistic over the tiles, with a strided sample of the pairwise slopes
+    step = max(1, n*(n - 1)//2//block_size)
+    s, n_slopes, sample = 0, 0, []
+    for dt, dy in tiles():
+        s += int((np.sign(dt)*np.sign(dy)).sum())
+        slopes = dy[dt != 0]/dt[dt != 0]
+        n_slopes += len(slopes)
+        sample.append(slopes[::step].copy())
+    sample = np.concatenate(sample)
+    
+    
+    #variance corrected for each group of tied results
+    ties = np.unique(y, return_counts=True)[1]
+    var_s = (n*(n - 1)*(2*n + 5) - (ties*(ties - 1)*(2*ties + 5)).sum())/18
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = np.std(y, ddof=1)/np.mean(y) if n > 1 else np.nan
+    
+    
+    #Sen's slope - bracket the median with the sample, then select it exactly from the slopes in the bracket
+    sens = np.nan
+    ranks = np.array([(n_slopes - 1)//2, n_slopes//2])
+    width = 4/np.sqrt(max(len(sample), 1))
+    while n_slopes:
+        lo, hi = np.quantile(sample, [0.5 - width, 0.5 + width]) if width < 0.5 else (-np.inf, np.inf)
+        below, inside = 0, []
+        for slopes in slope_tiles():
+            below += int((slopes < lo).sum())
+            inside.append(slopes[(slopes >= lo) & (slopes <= hi)])
+        inside = np.sort(np.concatenate(inside))
+        if below <= ranks[0] and ranks[1] < below + len(inside):
+            sens = inside[ranks - below].mean()
+            break
+        width *= 4
+    
+    return n, s, var_s, cov, sens
+
+
+def mann_kendall(series, block_size=2**22):
+    
+    
+    #sort the (dates, results) series by length so each block pads to a similar width
+    lengths = np.array([len(results) for dates, results in series])
+    order = np.argsort(lengths, kind='stable')
+    columns = ['N_Samples', 'S', 'Var_S', 'COV', 'Sens_Slope']
+    table = pd.DataFrame(np.nan, index=range(len(series)), columns=columns)
+    years = [(dates - np.datetime64('1970-01-01'))/np.timedelta64(1, 'D')/365.25 for dates, results in series]
+    
+    
+    #series with more than block_size pairs are tested on their own, in tiles
+    long_series = order[lengths[order]**2 > block_size]
+    order = order[lengths[order]**2 <= block_size]
+    for i in long_series:
+        table.loc[i, columns] = tiled_mann_kendall(years[i], series[i][1].astype(float), block_size)
+    
+    
+    #blocks of series with no more than about block_size pairs
+    start = 0
+    while start < len(order):
+        stop = start + 1
+        while stop < len(order) and (stop + 1 - start)*lengths[order[stop]]**2 <= block_size:
+            stop += 1
+        rows = order[start:stop]
+        start = stop
+        
+        
+        #pad the dates (years) and results of the block with NaN
+        width = max(lengths[rows].max(), 1)
+        filled = np.arange(width) < lengths[rows][:, None]
+        t = np.full(filled.shape, np.nan)
+        y = np.full(filled.shape, np.nan)
+        t[filled] = np.concatenate([years[i] for i in rows] + [[]])
+        y[filled] = np.concatenate([series[i][1] for i in rows] + [[]])
+        
+        
+        #every pair i < j of each series
+        dt = t[:, None, :] - t[:, :, None]
+        dy = y[:, None, :] - y[:, :, None]
+        pairs = np.triu(np.ones((width, width), dtype=bool), 1) & ~np.isnan(dy)
+        
+        
+        #S statistic, and its variance corrected for tied results
+        n = (~np.isnan(y)).sum(axis=1)
+        s = np.where(pairs, np.sign(dt)*np.sign(dy), 0).sum(axis=(1, 2))
+        ties = (dy == 0).sum(axis=2)
+        tie_sum = np.where(ties > 0, (ties - 1)*(2*ties + 5), 0).sum(axis=1)
+        var_s = (n*(n - 1)*(2*n + 5) - tie_sum)/18
+        
+        
+        #Sen's slope - median of the pairwise slopes (µg/L per year)
+        slopes = np.where(pairs & (dt != 0), dy/np.where(dt != 0, dt, 1), np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            sens = np.nanmedian(slopes.reshape(len(rows), -1), axis=1)
+            cov = np.nanstd(y, axis=1, ddof=1)/np.nanmean(y, axis=1)
+            cov = np.where(n > 1, cov, np.nan)
+        
+        table.loc[rows, columns] = np.column_stack([n, s, var_s, cov, sens])
+    
+    
+    #normal approximation with continuity correction
+    s, var_s = table['S'], table['Var_S']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(var_s > 0, (s - np.sign(s))/np.sqrt(var_s), 0)
+    table.insert(3, 'Z', z)
+    table.insert(4, 'P_Value', 2*special.ndtr(-np.abs(z)))
+    table.insert(5, 'Confidence', special.ndtr(np.abs(z)))
+    
+    
+    #GSI Mann-Kendall toolkit classification
+    s, cf, cov = table['S'], table['Confidence'], table['COV']
+    conditions = [table['N_Samples'] < 4,
+                  (s > 0) & (cf > 0.95), (s > 0) & (cf >= 0.90), s > 0,
+                  (s < 0) & (cf > 0.95), (s < 0) & (cf >= 0.90), cov >= 1]
+    choices = ['Insufficient Data', 'Increasing', 'Probably Increasing', 'No Trend',
+               'Decreasing', 'Probably Decreasing', 'No Trend']
+    table['Trend'] = np.select(conditions, choices, default='Stable')
+    table[['N_Samples', 'S']] = table[['N_Samples', 'S']].astype(int)
+    
+    return table
+
+
+'''define function to test the plotted CB, BZ and DB results of each well'''
+
+def trend_table(index, well_ids):
+    
+    series = [current for well_id in well_ids for current in well_series(index, well_id)]
+    table = mann_kendall(series)
+    table.insert(0, 'LOC_NAME', np.repeat(well_ids, len(ANALYTES)))
+    table.insert(1, 'CHEMICAL_NAME', ANALYTES*len(well_ids))
+    
+    return table
+
+
+'''define function to write the trend of each COC as a figure note'''
+
+trend_notes = {}                  #note for each well, empty unless the trends are annotated
+
+def trend_note(table):
+    
+    lines = [chemical + ': ' + trend for chemical, trend in zip(table['CHEMICAL_NAME'], table['Trend'])]
+    
+    return 'Mann-Kendall Trends:\n' + '\n'.join(lines)
+
+
+# In[ ]:
+
+
+'''define the HTML report - all well data in one payload, charts drawn in the browser as they scroll into view'''
+
+HTML_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+body {font-family: Arial, Helvetica, sans-serif; margin: 0; background: #eee;}
+header {position: sticky; top: 0; z-index: 1; background: #fff; padding: 8px 16px; border-bottom: 1px solid #bbb;}
+header input[type=search] {width: 320px; padding: 4px;}
+.chart {display: block; width: 980px; height: 700px; margin: 12px auto; background: #fff; box-shadow: 0 1px 3px #999;}
+.hidden {display: none;}
+</style>
+</head>
+<body>
+<header>
+<input type="search" id="search" placeholder="Search LOC ID or location">
+<label><input type="checkbox" id="log"> Log scale</label>
+<span id="count"></span>
+</header>
+<main id="charts"></main>
+<script id="payload" type="application/json">__PAYLOAD__</script>
+<script>
+(function () {
+  var P = JSON.parse(document.getElementById('payload').textContent);
+  var W = 980, H = 700, L = 100, R = 100, T = 70, B = 150;
+  var STYLE = {'Chlorobenzene': ['orange', 'triangle'], 'Benzene': ['green', 'square'],
+               '1,4-Dichlorobenzene': ['blue', 'diamond']};
+
+  function decode(text, Type) {
+    var raw = atob(text), bytes = new Uint8Array(raw.length);
+    for (var i = 0; i < raw.length; i++) bytes[i] = raw.charCodeAt(i);
+    return new Type(bytes.buffer);
+  }
+  var series = {};
+  P.analytes.forEach(function (a) {
+    series[a] = {offsets: P.series[a].offsets, days: decode(P.series[a].days, Int32Array),
+                 values: decode(P.series[a].values, Float32Array)};
+  });
+  function results(a, k) {
+    var s = series[a], i0 = s.offsets[k], i1 = s.offsets[k + 1];
+    return {days: s.days.subarray(i0, i1), values: s.values.subarray(i0, i1)};
+  }
+
+  function maxOf(list) {
+    var m = -Infinity;
+    list.forEach(function (r) { for (var i = 0; i < r.values.length; i++) if (r.values[i] > m) m = r.values[i]; });
+    return m;
+  }
+  function niceTicks(lo, hi) {
+    var step = Math.pow(10, Math.floor(Math.log10((hi - lo) / 5 || 1)));
+    [1, 2, 5, 10].some(function (f) { if ((hi - lo) / (step * f) <= 8) { step *= f; return true; } return false; });
+    var ticks = [];
+    for (var v = Math.ceil(lo / step) * step; v <= hi + step * 1e-9; v += step) ticks.push(+v.toPrecision(12));
+    return ticks;
+  }
+  function yAxis(max, log) {
+    if (!(max > 0)) max = 1;
+    if (log) {
+      var lo = Math.log10(0.1), hi = Math.log10(max * 1.1), ticks = [];
+      for (var e = Math.ceil(lo); e <= hi; e++) ticks.push(Math.pow(10, e));
+      return {ticks: ticks, y: function (v) { return T + (H - T - B) * (1 - (Math.log10(v) - lo) / (hi - lo)); }};
+    }
+    var top = max * 1.05;
+    return {ticks: niceTicks(0, top), y: function (v) { return T + (H - T - B) * (1 - v / top); }};
+  }
+  function dateLabel(day) {
+    var d = new Date(day * 86400000);
+    return ('0' + (d.getUTCMonth() + 1)).slice(-2) + '/' + ('0' + d.getUTCDate()).slice(-2) + '/' + d.getUTCFullYear();
+  }
+  function marker(ctx, shape, x, y) {
+    ctx.beginPath();
+    if (shape === 'diamond') { ctx.moveTo(x, y - 5); ctx.lineTo(x + 4, y); ctx.lineTo(x, y + 5); ctx.lineTo(x - 4, y); }
+    else if (shape === 'square') { ctx.rect(x - 4, y - 4, 8, 8); }
+    else { ctx.moveTo(x, y - 5); ctx.lineTo(x + 5, y + 4); ctx.lineTo(x - 5, y + 4); }
+    ctx.closePath(); ctx.fill();
+  }
+
+  function draw(canvas, k, log) {
+    var ratio = window.devicePixelRatio || 1, ctx = canvas.getContext('2d');
+    canvas.width = W * ratio; canvas.height = H * ratio;
+    ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+    ctx.fillStyle = '#fff'; ctx.fillRect(0, 0, W, H);
+
+    var cb = results('Chlorobenzene', k), bz = results('Benzene', k), db = results('1,4-Dichlorobenzene', k);
+    var asb = P.asb[k] === 1, first = Infinity, last = -Infinity;
+    [cb, bz, db].forEach(function (r) { if (r.days.length) { first = Math.min(first, r.days[0]); last = Math.max(last, r.days[r.days.length - 1]); } });
+    if (asb) { first = Math.min(first, P.asbStart); last = Math.max(last, P.asbStart); }
+    if (!isFinite(first)) { first = 0; last = 1; }
+    var pad = (last - first) * 0.05 || 30, x0 = first - pad, x1 = last + pad;
+    function x(day) { return L + (W - L - R) * (day - x0) / (x1 - x0); }
+    var left = yAxis(maxOf([db, bz]), log), right = yAxis(maxOf([cb]), log);
+
+    //gridlines, axes and tick labels
+    ctx.font = 'bold 12px Arial'; ctx.strokeStyle = '#000'; ctx.fillStyle = '#000'; ctx.lineWidth = 1;
+    ctx.textAlign = 'right'; ctx.textBaseline = 'middle';
+    left.ticks.forEach(function (v) {
+      var y = left.y(v); ctx.beginPath(); ctx.moveTo(L, y); ctx.lineTo(W - R, y); ctx.stroke(); ctx.fillText(v, L - 6, y);
+    });
+    ctx.textAlign = 'left';
+    right.ticks.forEach(function (v) { ctx.fillText(v, W - R + 6, right.y(v)); });
+    ctx.strokeRect(L, T, W - L - R, H - T - B);
+    var startYear = new Date(x0 * 86400000).getUTCFullYear() + 1, endYear = new Date(x1 * 86400000).getUTCFullYear();
+    var yearStep = Math.max(1, Math.ceil((endYear - startYear + 1) / 8));
+    ctx.textAlign = 'right';
+    for (var year = startYear; year <= endYear; year += yearStep) {
+      var day = Date.UTC(year, 0, 1) / 86400000, xt = x(day);
+      ctx.save(); ctx.translate(xt, H - B + 8); ctx.rotate(-Math.PI / 9); ctx.fillText(dateLabel(day), 0, 6); ctx.restore();
+    }
+
+    //axis labels and title
+    ctx.font = 'bold 14px Arial'; ctx.textAlign = 'center';
+    ctx.fillText('Sampling Date', L + (W - L - R) / 2, H - B + 62);
+    ctx.save(); ctx.translate(24, T + (H - T - B) / 2); ctx.rotate(-Math.PI / 2);
+    ctx.fillText('1,4-Dichlorobenzene and Benzene Concentration (µg/L)', 0, 0); ctx.restore();
+    ctx.save(); ctx.translate(W - 24, T + (H - T - B) / 2); ctx.rotate(Math.PI / 2);
+    ctx.fillText('Chlorobenzene Concentration (µg/L)', 0, 0); ctx.restore();
+    ctx.fillText('Figure B-' + P.fig[k] + (log ? ' Log Scale' : ''), W / 2, 24);
+    ctx.fillText(P.id[k] + ' ' + P.location[k] + ' Concentration vs. Time', W / 2, 44);
+
+    //AS/B Long-Term Operations Start
+    if (asb) {
+      ctx.strokeStyle = 'brown'; ctx.beginPath(); ctx.moveTo(x(P.asbStart), T); ctx.lineTo(x(P.asbStart), H - B); ctx.stroke();
+    }
+
+    //contaminant trends - 1,4-DCB and benzene on the left axis, chlorobenzene on the right
+    ctx.save(); ctx.beginPath(); ctx.rect(L, T, W - L - R, H - T - B); ctx.clip();
+    [['1,4-Dichlorobenzene', db, left], ['Benzene', bz, left], ['Chlorobenzene', cb, right]].forEach(function (item) {
+      var style = STYLE[item[0]], r = item[1], axis = item[2], started = false;
+      ctx.strokeStyle = style[0]; ctx.fillStyle = style[0]; ctx.lineWidth = 1.5; ctx.beginPath();
+      for (var i = 0; i < r.days.length; i++) {
+        var v = r.values[i];
+        if (!(v > 0) && log) { started = false; continue; }
+        var px = x(r.days[i]), py = axis.y(v);
+        if (started) ctx.lineTo(px, py); else ctx.moveTo(px, py);
+        started = true;
+      }
+      ctx.stroke();
+      for (var j = 0; j < r.days.length; j++) if (r.values[j] > 0 || !log) marker(ctx, style[1], x(r.days[j]), axis.y(r.values[j]));
+    });
+    ctx.restore();
+
+    //legend and MCL annotation
+    var entries = ['1,4-Dichlorobenzene', 'Benzene', 'Chlorobenzene'];
+    ctx.font = '11px Arial'; ctx.textAlign = 'left'; ctx.lineWidth = 1.5;
+    entries.forEach(function (a, i) {
+      var lx = 20 + 190 * i, ly = H - 24;
+      ctx.strokeStyle = STYLE[a][0]; ctx.fillStyle = STYLE[a][0];
+      ctx.beginPath(); ctx.moveTo(lx, ly); ctx.lineTo(lx + 30, ly); ctx.stroke(); marker(ctx, STYLE[a][1], lx + 15, ly);
+      ctx.fillStyle = '#000'; ctx.fillText(a, lx + 36, ly);
+    });
+    if (asb) {
+      ctx.strokeStyle = 'brown'; ctx.beginPath(); ctx.moveTo(590, H - 24); ctx.lineTo(620, H - 24); ctx.stroke();
+      ctx.fillStyle = '#000'; ctx.fillText('AS/B Long-Term Operations Start', 626, H - 24);
+    }
+    ctx.font = 'bold 10px Arial'; ctx.fillText('MCLs:', W - 190, H - 78);
+    ctx.font = '10px Arial';
+    P.analytes.forEach(function (a, i) { ctx.fillText(a + ' = ' + P.mcls[a] + ' µg/L', W - 190, H - 64 + 13 * i); });
+  }
+
+  //one placeholder per figure, drawn only when it scrolls into view
+  var main = document.getElementById('charts'), canvases = [], logBox = document.getElementById('log');
+  var observer = new IntersectionObserver(function (changes) {
+    changes.forEach(function (change) {
+      var canvas = change.target;
+      canvas.visible = change.isIntersecting;
+      if (canvas.visible && canvas.drawn !== logBox.checked) { draw(canvas, canvas.k, logBox.checked); canvas.drawn = logBox.checked; }
+    });
+  }, {rootMargin: '700px'});
+  for (var k = 0; k < P.id.length; k++) {
+    var canvas = document.createElement('canvas');
+    canvas.className = 'chart'; canvas.k = k; canvas.drawn = null;
+    main.appendChild(canvas); canvases.push(canvas); observer.observe(canvas);
+  }
+  logBox.addEventListener('change', function () {
+    canvases.forEach(function (canvas) { if (canvas.visible) { draw(canvas, canvas.k, logBox.checked); canvas.drawn = logBox.checked; } });
+  });
+
+  //search over LOC ID and location
+  var index = P.id.map(function (id, k) { return (id + ' ' + P.location[k]).toLowerCase(); });
+  var search = document.getElementById('search'), count = document.getElementById('count');
+  function filter() {
+    var words = search.value.toLowerCase().split(/\s+/).filter(Boolean), shown = 0;
+    canvases.forEach(function (canvas, k) {
+      var match = words.every(function (word) { return index[k].indexOf(word) >= 0; });
+      canvas.classList.toggle('hidden', !match); shown += match;
+    });
+    count.textContent = shown + ' of ' + canvases.length + ' figures';
+  }
+  search.addEventListener('input', filter);
+  filter();
+})();
+</script>
+</body>
+</html>
+'''
+
+
+def write_html_report(jobs, path, title):
+    
+    
+    #labels of each figure, in figure_labels order
+    fig_ids = [str(fig_id) for series, fig_id, well_id, plume_loc in jobs]
+    well_ids = [str(well_id) for series, fig_id, well_id, plume_loc in jobs]
+    plume_locs = [str(plume_loc) for series, fig_id, well_id, plume_loc in jobs]
+    asb = [int(well_id in ASB_WELLS) for well_id in well_ids]
+    
+    
+    #pack the dates (days since 1970) and results of each COC into one binary column each
+    columns = {}
+    for i, chemical in enumerate(ANALYTES):
+        dates = [series[i][0] for series, fig_id, well_id, plume_loc in jobs]
+        results = [series[i][1] for series, fig_id, well_id, plume_loc in jobs]
+        offsets = np.concatenate([[0], np.cumsum([len(d) for d in dates])]).astype(int)
+        days = np.concatenate([NO_RESULTS[0]] + dates).astype('datetime64[D]').astype('<i4')
+        values = np.concatenate([NO_RESULTS[1]] + results).astype('<f4')
+        columns[chemical] = {'offsets': offsets.tolist(),
+                             'days': base64.b64encode(days.tobytes()).decode('ascii'),
+                             'values': base64.b64encode(values.tobytes()).decode('ascii')}
+    
+    payload = {'analytes': ANALYTES, 'mcls': MCLS, 'fig': fig_ids, 'id': well_ids, 'location': plume_locs,
+               'asb': asb, 'asbStart': int(np.datetime64('2018-05-20', 'D').astype(int)), 'series': columns}
+    payload = json.dumps(payload, separators=(',', ':')).replace('</', '<\\/')
+    
+    
+    #write the report
+    html = HTML_TEMPLATE.replace('__TITLE__', title).replace('__PAYLOAD__', payload)
+    with open(path, 'w', encoding='utf-8') as report:
+        report.write(html)
+
+
 # In[4]:
 
 
@@ -316,9 +1142,18 @@ locs = [location for location in figure_labels['LOCATION']]
 # In[7]:
 
 
-'''Get all unique wells in the database export'''
+'''Get all unique wells in the database export and partition the results by well and COC'''
+
+wells_in_file = set(df['LOC_NAME'].unique())
+results_index = partition_results(df)
+
+
+# In[ ]:
+
+
+'''Summarize the results and MCL exceedances of each well and COC'''
 
-wells_in_file = df['LOC_NAME'].unique()
+summary_table(df, figure_labels).to_csv("C1_to_C555_2021_draft_Summary.csv", index=False)
 
 
 # In[8]:
@@ -326,7 +1161,7 @@ wells_in_file = df['LOC_NAME'].unique()
 
 ''' Build Graphics PDF - Normal Scale '''
 
-pdf_normal_scale = matplotlib.backends.backend_pdf.PdfPages("C1_to_C555_2021_draft_NORMAL.pdf")
+normal_pdf_path = "C1_to_C555_2021_draft_NORMAL.pdf"
 
 
 # In[9]:
@@ -334,41 +1169,65 @@ pdf_normal_scale = matplotlib.backends.backend_pdf.PdfPages("C1_to_C555_2021_dra
 
 ''' Build Graphics PDF - Log Scale '''
 
-pdf_log_scale = matplotlib.backends.backend_pdf.PdfPages("C1_to_C555_2021_draft_LOG.pdf")
+log_pdf_path = "C1_to_C555_2021_draft_LOG.pdf"
+
+
+# In[ ]:
+
+
+'''Mann-Kendall trend test and Sen's slope for each well and COC'''
+
+TREND_TESTS = True                #test every well and COC for trends, False skips the tests and the notes
+ANNOTATE_TRENDS = False           #add the trend of each COC to the figures
+
+if TREND_TESTS:
+    trends = trend_table(results_index, [well_id for well_id in loc_ids if well_id in wells_in_file])
+    trends.to_csv("C1_to_C555_2021_draft_Mann_Kendall.csv", index=False)
+
+if TREND_TESTS and ANNOTATE_TRENDS:
+    trend_notes.update({well_id: trend_note(table) for well_id, table in trends.groupby('LOC_NAME')})
 
 
 # In[10]:
 
 
-'''loop over each element in the list and make a graph for each LOC ID, log scale'''
+'''loop over each element in the list and make one graph for each LOC ID, saved at normal and log scale'''
+
+N_WORKERS = 1                     #processes for rendering the graphics, 1 renders serially for debugging
+RECYCLE_FIGURES = False           #update one styled figure for every well instead of building a new one
+MAX_POINTS = None                 #downsample each series to about this many results, None plots every result
+COMPACT_PDF = False               #draw the markers as images, text and axes stay vectors - smaller only for dense series, sparse pdfs grow
+RASTER_DPI = 200                  #resolution of the marker images in compact pdfs
+
+jobs = []                         #one job per figure in figure_labels order
 
 for i, well_id in enumerate(loc_ids):
     if well_id not in wells_in_file:
         continue
-    current_well = df[df["LOC_NAME"] == well_id]
-    fig_log = graph_log_scale(current_well, fig_nums[i], well_id, locs[i])
-    pdf_log_scale.savefig(fig_log)
-    
-'''close PDFs'''    
+    current_well = well_series(results_index, well_id, MAX_POINTS)
+    jobs.append((current_well, fig_nums[i], well_id, locs[i]))
 
-pdf_log_scale.close()
+CACHE_DIR = None                  #folder for cached pages, None turns the cache off
+CACHE_MAX_MB = 2000               #size of the cache before the oldest pages are deleted
 
+HTML_REPORT = False               #also write the searchable HTML report
 
-# In[11]:
+if HTML_REPORT:
+    write_html_report(jobs, "C1_to_C555_2021_draft.html", "C1 to C555 Concentration vs. Time")
 
+if CACHE_DIR is None:
+    render_pdfs(jobs, normal_pdf_path, log_pdf_path, N_WORKERS)
+else:
+    cached_render_pdfs(jobs, normal_pdf_path, log_pdf_path, CACHE_DIR, N_WORKERS)
+    evict_cache(CACHE_DIR, CACHE_MAX_MB*2**20)
+
+OVERVIEW_GRID = None              #(rows, columns) of wells per page for the overview pdf, e.g. (3, 4), None skips it
+OVERVIEW_LOG_SCALE = True         #scale of the overview pdf
+
+if OVERVIEW_GRID is not None:
+    write_overview(jobs, "C1_to_C555_2021_draft_OVERVIEW.pdf", OVERVIEW_GRID, OVERVIEW_LOG_SCALE)
 
-'''loop over each element in the list and make a graph for each LOC ID, normal scale'''
 
-for i, well_id in enumerate(loc_ids):
-    if well_id not in wells_in_file:
-        continue
-    current_well = df[df["LOC_NAME"] == well_id]
-    fig_norm = graph(current_well, fig_nums[i], well_id, locs[i])
-    pdf_normal_scale.savefig(fig_norm)
-    
-'''close PDFs'''    
-    
-pdf_normal_scale.close()
 
 
 
@@ -10,51 +10,206 @@
    Power BI. The input is a CSV that contains 5-minute interval 
    temperature data and the locations that the data was collected.
    The output is a figure showing the daily temperature maximum 
-   at each of the monitoring locations.'''
+   at each of the monitoring locations, and one more figure for 
+   each other logged parameter listed in PARAMETERS.'''
 
 
 # In[1]:
 
 
 import pandas as pd 
+import numpy as np
 from matplotlib import pyplot as plt
+import matplotlib.colors as mcolors
 import matplotlib.dates as mdates
+from matplotlib.lines import Line2D
 from datetime import datetime
+import glob
+import os
+
+#parameters in dataset - (column, daily reduction 'max' or 'min', limit column, axis label), one figure each
+PARAMETERS = [('Temp', 'max', 'daily_max_limit', 'Temperature, °F')]
+#e.g. ('DO', 'min', 'do_min_limit', 'Dissolved Oxygen, mg/L'), ('pH', 'max', 'ph_max_limit', 'pH'),
+#     ('Conductivity', 'max', 'sc_max_limit', 'Specific Conductance, µS/cm')
+
+#other daily statistics to plot with the reduction of each parameter - 'max', 'min' or 'mean'
+DAILY_STATS = []
+STAT_MARKERS = {'max': 'o', 'min': 'v', 'mean': 'x'}
+
+#colors of the known locations, other locations take the palette colors in turn
+LOCATION_COLORS = {'Downstream Confluence': 'cyan',
+                   'Upstream Tributary': 'purple',
+                   'PPG Outfall': 'blue',
+                   'PPG Outfall Upstream': 'orange',
+                   'Upstream Tributary, Upstream': 'magenta'}
+PALETTE = plt.get_cmap('tab10').colors
+
+#folder of the daily store from Logger-Daily-Store-Ingest.py (Temp only), None uses the readings in dataset
+DAILY_STORE_PATH = None
+
+#'daily' plots the daily statistics, 'density' bins every reading in dataset into an image
+RENDER_MODE = 'daily'
+DENSITY_BINS = (1000, 400)        #time and parameter bins of the density image
+
+#7-day average of the daily reduction (7DADM for a daily maximum) and the exceedances of each limit
+SEVEN_DAY_TABLE_PATH = None       #csv of the 7-day average and exceedances of each parameter, location and day, None skips it
+EXCEEDANCE_SUMMARY_PATH = None    #csv of the exceedance counts of each parameter and location, None skips it
+SHOW_SEVEN_DAY = False            #draw the 7-day average of each location and circle its exceedances
+SEVEN_DAY_NAMES = {'max': '7DADM', 'min': '7DADMin'}
+
+#file for each figure, e.g. 'Daily_{}.png' is filled in with the parameter column, None only shows the figures
+FIGURE_FILE = None
+
+#daily statistics of each parameter, its reduction first
+stats = {column: [reduction] + [stat for stat in DAILY_STATS if stat != reduction]
+         for column, reduction, limit_column, label in PARAMETERS}
 
 #convert to datetime
-dataset['date'] = pd.to_datetime(dataset['date'], format = '%Y-%m-%d')
-
-#subset by location
-dconf = dataset[dataset['Location']== 'Downstream Confluence']
-uptrib = dataset[dataset['Location'] == 'Upstream Tributary']
-ppg_out = dataset[dataset['Location'] == 'PPG Outfall']
-ppg_up = dataset[dataset['Location'] == 'PPG Outfall Upstream']
-uptrib_up = dataset[dataset['Location'] == 'Upstream Tributary, Upstream']
-
-#create the subplot
-fig = plt.figure(figsize=(12,8))
-ax = plt.subplot(1,1,1)
-
-#map the variables
-ax.scatter(dconf['date'], dconf['Temp'], color = 'cyan', label ='Downstream Confluence' )
-ax.scatter(uptrib['date'], uptrib['Temp'], color = 'purple', label ='Upstream Tributary')
-ax.scatter(ppg_out['date'], ppg_out['Temp'], color = 'blue', label ='PPG Outfall')
-ax.scatter(ppg_up['date'], ppg_up['Temp'], color = 'orange', label ='PPG Outfall Upstream')
-ax.scatter(uptrib_up['date'], uptrib_up['Temp'], color = 'magenta', label ='Upstream Tributary, Upstream')
-ax.plot(dataset['date'], dataset['daily_max_limit'], label ='Daily Temperature Maxiumum')
-
-#set x-axis to preferred date format
-fmt_half_year = mdates.MonthLocator(interval=6)
-ax.xaxis.set_major_locator(fmt_half_year)
-ax.xaxis.set_major_formatter(mdates.DateFormatter('%b-%Y'))
-
-#draw legend
-ax.legend(loc="lower center", bbox_to_anchor=(0.5, -0.16), ncol = 6)
-
-#make axes labels
-plt.xlabel('Date', fontsize = 14)
-plt.ylabel('Temperature, °F', fontsize= 14)
-plt.title('Daily Maximum Temperature', fontsize =14)
+if DAILY_STORE_PATH is None or RENDER_MODE == 'density':
+    dataset['date'] = pd.to_datetime(dataset['date'], format = '%Y-%m-%d')
+
+if DAILY_STORE_PATH is None:
+    
+    #reduce the 5-minute readings of every parameter and limit in one grouped pass over location and day
+    day = dataset['date'].dt.normalize()
+    aggregations = {column + ' ' + stat: (column, stat) for column in stats for stat in stats[column]}
+    aggregations.update({limit_column: (limit_column, 'max') for column, reduction, limit_column, label in PARAMETERS})
+    daily = dataset.groupby(['Location', day]).agg(**aggregations).reset_index()
+else:
+    
+    #read the daily statistics of each location, the mean is the sum over the count
+    store = pd.concat([pd.read_parquet(path) for path in sorted(glob.glob(os.path.join(DAILY_STORE_PATH, 'daily_*.parquet')))],
+                      ignore_index=True)
+    store['mean'] = store['sum']/store['count']
+    daily = store.rename(columns = {stat: 'Temp ' + stat for stat in ['max', 'min', 'mean']})
+
+#limit of each day
+limits = daily.groupby('date')[[limit_column for column, reduction, limit_column, label in PARAMETERS]].max()
+
+#partition by location in one categorical pass - known locations first, in the order above
+location = daily['Location'].astype('category')
+found = location.cat.categories
+names = [name for name in LOCATION_COLORS if name in found] + [name for name in found if name not in LOCATION_COLORS]
+location = location.cat.reorder_categories(names)
+others = iter(PALETTE*(len(names)//len(PALETTE) + 1))
+colors = np.array([mcolors.to_rgba(LOCATION_COLORS[name] if name in LOCATION_COLORS else next(others)) for name in names])
+location_colors = dict(zip(names, colors))
+
+#draw the locations in turn, each point takes the color of its location
+order = np.argsort(location.cat.codes.to_numpy(), kind='stable')
+daily = daily.iloc[order]
+point_colors = colors[location.cat.codes.to_numpy()[order]]
+
+#time bin and location of each reading, shared by the density image of every parameter
+if RENDER_MODE == 'density':
+    codes = pd.Categorical(dataset['Location'], categories = names).codes.astype(np.intp)
+    x = mdates.date2num(dataset['date'].to_numpy())
+    x0, x1 = x.min(), x.max() + 1
+    n_x, n_y = min(DENSITY_BINS[0], int(round(x1 - x0))), DENSITY_BINS[1]     #dates are days, so no more than one bin per day
+    x_bin = np.minimum(((x + 0.5 - x0)/(x1 - x0)*n_x).astype(np.intp), n_x - 1)       #binned at the middle of the day
+
+seven_days = []
+exceedances = []
+
+for column, reduction, limit_column, label in PARAMETERS:
+    
+    name = label.split(',')[0]
+    word = 'Maximum' if reduction == 'max' else 'Minimum'
+    seven_day_name = SEVEN_DAY_NAMES[reduction]
+    beyond = np.greater if reduction == 'max' else np.less      #a daily maximum exceeds above its limit, a minimum below
+    limit = limits[limit_column]
+    
+    #rolling mean over the days of each location, a complete 7-day window is needed for a 7-day average
+    seven_day = daily[['Location', 'date', column + ' ' + reduction]].set_axis(['Location', 'date', 'Daily'], axis = 1)
+    seven_day = seven_day.sort_values(['Location', 'date'], kind='mergesort').reset_index(drop=True)
+    seven_day['Seven_Day_Average'] = seven_day.groupby('Location').rolling('7D', on='date', min_periods=7)['Daily'].mean().to_numpy()
+    seven_day['Limit'] = seven_day['date'].map(limit)
+    seven_day['Exceeds_Daily'] = beyond(seven_day['Daily'], seven_day['Limit'])
+    seven_day['Exceeds_Seven_Day'] = beyond(seven_day['Seven_Day_Average'], seven_day['Limit'])
+    
+    #number each run of days - a new run starts at a new location, a change of exceedance or a missing day
+    new_run = ((seven_day['Location'] != seven_day['Location'].shift())
+               | (seven_day['Exceeds_Seven_Day'] != seven_day['Exceeds_Seven_Day'].shift())
+               | (seven_day['date'].diff() != pd.Timedelta(days=1)))
+    seven_day['Exceedance_Run_Days'] = seven_day.groupby(new_run.cumsum())['Exceeds_Seven_Day'].transform('sum')
+    seven_day.insert(0, 'Parameter', column)
+    seven_days.append(seven_day)
+    
+    #exceedance counts of each location
+    exceedances.append(seven_day.groupby(['Parameter', 'Location']).agg(Days = ('Daily', 'count'),
+                                                                        Daily_Exceedances = ('Exceeds_Daily', 'sum'),
+                                                                        Worst_Seven_Day_Average = ('Seven_Day_Average', reduction),
+                                                                        Seven_Day_Exceedances = ('Exceeds_Seven_Day', 'sum'),
+                                                                        Longest_Exceedance_Run = ('Exceedance_Run_Days', 'max')))
+    
+    #create the subplot
+    fig = plt.figure(figsize=(12,8))
+    ax = plt.subplot(1,1,1)
+    
+    #map the variables, one scatter for each statistic
+    if RENDER_MODE == 'daily':
+        for stat in stats[column]:
+            ax.scatter(daily['date'], daily[column + ' ' + stat], c = point_colors, marker = STAT_MARKERS[stat])
+    
+    #or count the readings of each location in (time, parameter) bins
+    else:
+        y = dataset[column].to_numpy(dtype = float)
+        keep = np.isfinite(y) & (codes >= 0)
+        y0, y1 = y[keep].min(), max(y[keep].max(), y[keep].min() + 1e-9)
+        y_bin = np.minimum(((y[keep] - y0)/(y1 - y0)*n_y).astype(np.intp), n_y - 1)
+        counts = np.bincount((codes[keep]*n_y + y_bin)*n_x + x_bin[keep], minlength = len(names)*n_y*n_x).reshape(len(names), n_y, n_x)
+        
+        #shade each location in its color by log count, layered in turn like the scatter
+        shade = np.log1p(counts)/np.log1p(counts.max())
+        premultiplied = np.zeros((n_y, n_x, 3))
+        coverage = np.zeros((n_y, n_x))
+        for alpha, color in zip(shade, colors):
+            premultiplied = color[:3]*alpha[..., None] + premultiplied*(1 - alpha[..., None])
+            coverage = alpha + coverage*(1 - alpha)
+        image = np.dstack([premultiplied/np.maximum(coverage, 1e-12)[..., None], coverage])
+        ax.imshow(image, extent = (x0, x1, y0, y1), origin = 'lower', aspect = 'auto', interpolation = 'nearest')
+        ax.xaxis_date()
+    
+    limit_line, = ax.plot(limit.index, limit.values, label ='Daily ' + name + ' ' + word)
+    
+    #legend entries for each location in the marker of the reduction, a gray marker for each other statistic, and the limit
+    handles = [Line2D([], [], linestyle = 'none', marker = STAT_MARKERS[stats[column][0]], color = color, label = location_name)
+               for location_name, color in zip(names, colors)]
+    handles += [Line2D([], [], linestyle = 'none', marker = STAT_MARKERS[stat], color = 'gray', label = 'Daily ' + stat)
+                for stat in stats[column][1:] if RENDER_MODE == 'daily']
+    handles.append(limit_line)
+    
+    #draw the 7-day average of each location in its color and circle the exceedances (if applicable)
+    if SHOW_SEVEN_DAY:
+        for location_name, current in seven_day.groupby('Location'):
+            ax.plot(current['date'], current['Seven_Day_Average'], color = location_colors[location_name], linewidth = 2)
+        exceeds = seven_day[seven_day['Exceeds_Seven_Day']]
+        ax.scatter(exceeds['date'], exceeds['Seven_Day_Average'], facecolors = 'none', edgecolors = 'red', s = 40)
+        handles += [Line2D([], [], color = 'gray', linewidth = 2, label = '7-Day Average Daily ' + word),
+                    Line2D([], [], linestyle = 'none', marker = 'o', markerfacecolor = 'none', markeredgecolor = 'red',
+                           label = seven_day_name + ' Exceedance')]
+    
+    #set x-axis to preferred date format
+    fmt_half_year = mdates.MonthLocator(interval=6)
+    ax.xaxis.set_major_locator(fmt_half_year)
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%b-%Y'))
+    
+    #draw legend
+    ax.legend(handles = handles, loc="lower center", bbox_to_anchor=(0.5, -0.16), ncol = 6)
+    
+    #make axes labels
+    plt.xlabel('Date', fontsize = 14)
+    plt.ylabel(label, fontsize= 14)
+    plt.title('Daily ' + word + ' ' + name, fontsize =14)
+    
+    if FIGURE_FILE is not None:
+        fig.savefig(FIGURE_FILE.format(column))
+
+#write the 7-day averages and exceedance counts of every parameter
+if SEVEN_DAY_TABLE_PATH is not None:
+    pd.concat(seven_days, ignore_index = True).to_csv(SEVEN_DAY_TABLE_PATH, index = False)
+if EXCEEDANCE_SUMMARY_PATH is not None:
+    pd.concat(exceedances).to_csv(EXCEEDANCE_SUMMARY_PATH)
 
 plt.show()
 
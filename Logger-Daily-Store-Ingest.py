@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# In[ ]:
+
+
+'''This program builds the daily temperature store used by the
+   daily maximum temperature figure. The inputs are logger CSV
+   downloads of 5-minute interval data with the same date,
+   Location, Temp and daily_max_limit columns as the Power BI
+   dataset. Each download is read in chunks and reduced to daily
+   count, sum, minimum and maximum at each location. The output
+   is a folder of parquet files, one per month, that new downloads
+   are merged into, with a manifest of the downloads already
+   ingested so they are never counted twice. Each download is
+   recorded in the manifest before its months are swapped in, so
+   a run that fails partway is finished by the next run.'''
+
+
+# In[1]:
+
+
+'''import modules'''
+
+import pandas as pd
+import glob
+import hashlib
+import json
+import os
+
+
+# In[2]:
+
+
+'''define the daily partial statistics - any two partials of a location and day merge into one'''
+
+KEYS = ['Location', 'date']
+
+def daily_partials(chunk):
+
+    #reduce the readings to count, sum, minimum and maximum at each location and day
+    chunk = chunk.assign(date = pd.to_datetime(chunk['date']).dt.normalize())
+    if 'daily_max_limit' not in chunk:
+        chunk = chunk.assign(daily_max_limit = float('nan'))
+    partials = chunk.groupby(KEYS).agg(count = ('Temp', 'count'), sum = ('Temp', 'sum'),
+                                       min = ('Temp', 'min'), max = ('Temp', 'max'),
+                                       daily_max_limit = ('daily_max_limit', 'max'))
+
+    return partials.reset_index()
+
+
+def merge_partials(partials):
+
+    #counts and sums add, minimums and maximums take the extreme
+    merged = partials.groupby(KEYS).agg(count = ('count', 'sum'), sum = ('sum', 'sum'),
+                                        min = ('min', 'min'), max = ('max', 'max'),
+                                        daily_max_limit = ('daily_max_limit', 'max'))
+
+    return merged.reset_index()
+
+
+# In[3]:
+
+
+'''define functions to read a download and merge it into the store'''
+
+def file_digest(path):
+
+    #sha256 of the file contents, so a renamed copy of a download is still recognized
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def read_download(path, chunk_rows):
+
+    #reduce each chunk as it is read, then merge the partials of the chunks
+    partials = []
+    rows = 0
+    for chunk in pd.read_csv(path, chunksize=chunk_rows):
+        partials.append(daily_partials(chunk))
+        rows += len(chunk)
+
+    return merge_partials(pd.concat(partials)), rows
+
+
+def stage_partitions(store_path, partials):
+
+    #merge the partials into a staged copy of the parquet file of each month
+    months = []
+    for month, part in partials.groupby(partials['date'].dt.to_period('M')):
+        path = os.path.join(store_path, 'daily_' + str(month) + '.parquet')
+        if os.path.exists(path):
+            part = merge_partials(pd.concat([pd.read_parquet(path), part]))
+        part.sort_values(KEYS).to_parquet(path + '.tmp', index=False)
+        months.append(str(month))
+
+    return months
+
+
+def swap_partitions(store_path, months):
+
+    #staged copies replace the month files - a copy already swapped in is skipped
+    for month in months:
+        path = os.path.join(store_path, 'daily_' + month + '.parquet')
+        if os.path.exists(path + '.tmp'):
+            os.replace(path + '.tmp', path)
+
+
+def read_manifest(store_path):
+
+    path = os.path.join(store_path, '_manifest.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(store_path, manifest):
+
+    path = os.path.join(store_path, '_manifest.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def recover(store_path, manifest):
+
+    #finish the swaps of a download recorded before a failed run, then drop the copies staged for unrecorded downloads
+    for entry in manifest.values():
+        if 'pending' in entry:
+            swap_partitions(store_path, entry.pop('pending'))
+            write_manifest(store_path, manifest)
+    for path in glob.glob(os.path.join(store_path, 'daily_*.parquet.tmp')):
+        os.remove(path)
+
+
+def ingest(paths, store_path, chunk_rows=1000000):
+
+
+    #skip the downloads already in the manifest
+    os.makedirs(store_path, exist_ok=True)
+    manifest = read_manifest(store_path)
+    recover(store_path, manifest)
+
+
+    #stage every month of each new download, record it with its pending months, then swap the months in
+    for path in paths:
+        digest = file_digest(path)
+        if digest in manifest:
+            print('skipped', path, '- already ingested as', manifest[digest]['file'])
+            continue
+        partials, rows = read_download(path, chunk_rows)
+        months = stage_partitions(store_path, partials)
+        manifest[digest] = {'file': os.path.basename(path), 'rows': rows, 'days': len(partials),
+                            'first_date': str(partials['date'].min().date()), 'last_date': str(partials['date'].max().date()),
+                            'ingested': pd.Timestamp.now().isoformat(timespec='seconds'), 'pending': months}
+        write_manifest(store_path, manifest)
+        swap_partitions(store_path, manifest[digest].pop('pending'))
+        write_manifest(store_path, manifest)
+        print('ingested', path, '-', rows, 'readings,', len(partials), 'location days')
+
+
+'''define function to read the daily store back'''
+
+def read_store(store_path):
+
+    daily = pd.concat([pd.read_parquet(path) for path in sorted(glob.glob(os.path.join(store_path, 'daily_*.parquet')))],
+                      ignore_index=True)
+
+    return daily.assign(mean = daily['sum']/daily['count'])
+
+
+# In[4]:
+
+
+STORE_PATH = 'Daily_Temperature_Store'                  #folder of the daily store, set the same folder as DAILY_STORE_PATH in the figure
+DOWNLOADS = 'Logger_Downloads/*.csv'                    #logger csv downloads to ingest
+CHUNK_ROWS = 1000000                                    #readings read at a time
+
+ingest(sorted(glob.glob(DOWNLOADS)), STORE_PATH, CHUNK_ROWS)
+
+read_store(STORE_PATH).tail()